@@ -3,11 +3,11 @@ from django.urls import path, re_path, include
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework.authentication import SessionAuthentication
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework import permissions
 
-from core.routes import router as core_router
+from core.routes import router as core_router, async_urlpatterns as core_async_urls
 from config.settings import MEDIA_URL, MEDIA_ROOT
+from services.authentication import CachedJWTAuthentication
 from django.conf import settings
 
 schema_view = get_schema_view(
@@ -21,10 +21,11 @@ schema_view = get_schema_view(
     ),
     public=True,
     url=f'{settings.BASE_URL}/api',
-    authentication_classes=(SessionAuthentication, JWTAuthentication,),
+    authentication_classes=(SessionAuthentication, CachedJWTAuthentication,),
     permission_classes=(permissions.AllowAny,),
 )
 urlpatterns = [
+    path('v1/async/', include(core_async_urls)),
     path('v1/', include(core_router.urls)),
     path(r'', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=1), name='schema-json'),
@@ -26,6 +26,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'silk',
     'corsheaders',
@@ -36,15 +37,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'services.metrics.MetricsMiddleware',
+    'services.profiling.SampledProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'silk.middleware.SilkyMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'services.middleware.ReadYourWritesMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -78,6 +81,21 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD')
     }
 }
+# optional read replica, reads of the application models are routed to it by services.routers
+if config('DB_REPLICA_NAME', ''):
+    DATABASES['replica'] = {
+        'NAME': config('DB_REPLICA_NAME'),
+        'ENGINE': config('DB_ENGINE'),
+        'USER': config('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': config('DB_REPLICA_HOST', ''),
+        'PORT': config('DB_REPLICA_PORT', ''),
+        'TEST': {'MIRROR': 'default'},
+    }
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['services.routers.PrimaryReplicaRouter']
+# seconds a user keeps reading from the primary after writing, should exceed the replication lag
+READ_YOUR_WRITES_WINDOW = config('READ_YOUR_WRITES_WINDOW', 5, cast=int)
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -121,6 +139,10 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 STATICFILES_DIRS = (os.path.join(BASE_DIR, "staticfiles"),)
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# number of background threads rendering resized variants of uploaded images
+IMAGE_VARIANT_WORKERS = config('IMAGE_VARIANT_WORKERS', 2, cast=int)
+# bounded thread pool running ORM work for the async read endpoints
+ASYNC_ORM_WORKERS = config('ASYNC_ORM_WORKERS', 8, cast=int)
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -178,6 +200,25 @@ LOGGING = {
     },
 }
 
+# LOG_QUEUE_ENABLED moves writing off the request thread, records go through a bounded queue to a background
+# thread writing core.log as JSON lines, records are dropped rather than blocking once LOG_QUEUE_SIZE are waiting
+LOG_QUEUE_ENABLED = config('LOG_QUEUE_ENABLED', False, cast=bool)
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', 10000, cast=int)
+if LOG_QUEUE_ENABLED:
+    LOGGING["handlers"]["handler_core"] = {
+        "level": "INFO",
+        "class": "services.log.QueuedJsonFileHandler",
+        "filename": os.path.join(LOGS_DIR, "core.log"),
+        "maxBytes": 500 * 10 ** 6,
+        "backupCount": 10,
+        "queue_size": LOG_QUEUE_SIZE,
+    }
+# tracebacks with every frame's local variables are slow to render, only this many are logged per window
+# (per process), the rest are logged as plain tracebacks
+LOG_TRACEBACK_VARIABLES_LIMIT = config('LOG_TRACEBACK_VARIABLES_LIMIT', 10, cast=int)
+LOG_TRACEBACK_VARIABLES_WINDOW = config('LOG_TRACEBACK_VARIABLES_WINDOW', 60, cast=int)
+LOG_TRACEBACK_MAX_VALUE_LENGTH = config('LOG_TRACEBACK_MAX_VALUE_LENGTH', 500, cast=int)
+
 # COR-HEADERS CONFIGURATION
 CORS_ALLOW_HEADERS = list(default_headers)
 CORS_ALLOW_CREDENTIALS = True
@@ -194,12 +235,20 @@ SESSION_COOKIE_HTTPONLY = True
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.SessionAuthentication",
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "services.authentication.CachedJWTAuthentication",
 
     ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
-
+    "DEFAULT_RENDERER_CLASSES": [
+        "services.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "services.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 # SIMPLE JWT
@@ -237,6 +286,15 @@ CACHES = {
         "KEY_PREFIX": "blog"
     }
 }
+# PAGE CACHE STAMPEDE PROTECTION, cached pages outlive their timeout by PAGE_CACHE_STALE_TTL seconds and are
+# served stale while a single request holding the rebuild lock (at most PAGE_CACHE_LOCK_TIMEOUT seconds) renders
+# the new page. Requests with no page to serve wait up to PAGE_CACHE_LOCK_WAIT seconds for it. A higher
+# PAGE_CACHE_EARLY_REFRESH_BETA rebuilds pages earlier before they expire, 0 disables early refresh
+PAGE_CACHE_STALE_TTL = config('PAGE_CACHE_STALE_TTL', 60, cast=int)
+PAGE_CACHE_LOCK_TIMEOUT = config('PAGE_CACHE_LOCK_TIMEOUT', 10, cast=int)
+PAGE_CACHE_LOCK_WAIT = config('PAGE_CACHE_LOCK_WAIT', 2, cast=float)
+PAGE_CACHE_EARLY_REFRESH_BETA = config('PAGE_CACHE_EARLY_REFRESH_BETA', 1.0, cast=float)
+
 # SWAGGER CONFIGURATION
 LOGIN_URL = 'rest_framework:login'
 LOGOUT_URL = 'rest_framework:logout'
@@ -250,4 +308,36 @@ SWAGGER_SETTINGS = {
     "TAGS_SORTER": "alpha",
 }
 
-SILKY_PYTHON_PROFILER = True
+# METRICS, Prometheus text format served on /metrics. Set PROMETHEUS_MULTIPROC_DIR in the environment of
+# every worker (an empty directory, cleared on deploy) so the endpoint aggregates all worker processes
+METRICS_TOKEN = config('METRICS_TOKEN', '')
+
+# RESPONSE COMPRESSION of cached pages, negotiated on Accept-Encoding (brotli when installed, then gzip).
+# Pages are compressed once when cached, so the levels can trade some CPU on a miss for smaller responses
+RESPONSE_COMPRESSION_MIN_LENGTH = config('RESPONSE_COMPRESSION_MIN_LENGTH', 200, cast=int)
+RESPONSE_GZIP_LEVEL = config('RESPONSE_GZIP_LEVEL', 6, cast=int)
+RESPONSE_BROTLI_QUALITY = config('RESPONSE_BROTLI_QUALITY', 5, cast=int)
+
+# SAMPLED PROFILING, off by default. Samples are buffered in memory and written to silk's tables in batches,
+# browse them under /silk-profiler
+PROFILING_ENABLED = config('PROFILING_ENABLED', False, cast=bool)
+# requests sending this value in the X-Profile header are always profiled, empty disables the trigger
+PROFILING_HEADER_TOKEN = config('PROFILING_HEADER_TOKEN', '')
+PROFILING_DEFAULT_SAMPLE_RATE = config('PROFILING_DEFAULT_SAMPLE_RATE', 0.0, cast=float)
+# per endpoint rates keyed by url name, e.g. post-list=0.01;post-detail=0.001
+PROFILING_SAMPLE_RATES = {
+    name: float(rate) for name, rate in
+    (item.split('=') for item in config('PROFILING_SAMPLE_RATES', '').split(';') if item)
+}
+PROFILING_FLUSH_SIZE = config('PROFILING_FLUSH_SIZE', 50, cast=int)
+PROFILING_FLUSH_INTERVAL = config('PROFILING_FLUSH_INTERVAL', 60, cast=int)
+# samples beyond this are dropped (oldest first) while the database is unavailable
+PROFILING_BUFFER_SIZE = config('PROFILING_BUFFER_SIZE', 1000, cast=int)
+PROFILING_TOP_FUNCTIONS = config('PROFILING_TOP_FUNCTIONS', 40, cast=int)
+
+# silk's own middleware records every request, SQL query and profile synchronously, only turn it on locally.
+# It is sync only, under ASGI it makes Django adapt the whole chain to sync and the async views hold a thread
+SILK_MIDDLEWARE_ENABLED = config('SILK_MIDDLEWARE_ENABLED', False, cast=bool)
+if SILK_MIDDLEWARE_ENABLED:
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.csrf.CsrfViewMiddleware'), 'silk.middleware.SilkyMiddleware')
+SILKY_PYTHON_PROFILER = SILK_MIDDLEWARE_ENABLED
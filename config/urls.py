@@ -3,13 +3,15 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from core.views import account_logout
+from services.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/", include("config.api_urls")),
     path(r'api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path(r'accounts/logout/', account_logout),
-    path('silk-profiler', include('silk.urls', namespace='silk'))
+    path('silk-profiler', include('silk.urls', namespace='silk')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.request import Request
+
+from core.views import PostViewSet, PostCommentViewSet
+from services.async_cache import async_cache_get, async_cache_set, async_get_cache_generation, run_blocking
+from services.cache import POST_CACHE_PREFIX, get_object_cache_key, get_version_key, get_versions
+from services.compression import compress_response, negotiate_request_encoding
+from services.log import format_exc
+from services.metrics import record_cache_lookup
+from services.renderers import ORJSONRenderer
+from services.routers import pin_to_primary, user_is_pinned
+
+logger = logging.getLogger('core')
+
+POST_LIST_CACHE_TIMEOUT = 60 * 2
+
+
+def require_get(view_func):
+    """django's require_GET wraps views in a sync function, which would hide the coroutine"""
+
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET'])
+        return await view_func(request, *args, **kwargs)
+
+    return wrapper
+
+
+def get_viewset(viewset_class, request, **kwargs):
+    """Prepares a viewset instance so its sync helpers can be reused outside DRF's dispatch"""
+    view = viewset_class()
+    view.request = Request(request, authenticators=view.get_authenticators())
+    view.args = ()
+    view.kwargs = kwargs
+    view.format_kwarg = None
+    return view
+
+
+def has_credentials(request) -> bool:
+    return 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+def authenticate(viewset_class, request) -> bool:
+    """
+    Authenticates the request with the viewset's authenticators, as DRF's dispatch would, and tells whether
+    its user wrote within READ_YOUR_WRITES_WINDOW, in which case the reads must go to the primary
+    """
+    user = get_viewset(viewset_class, request).request.user
+    return user.is_authenticated and user_is_pinned(user.id)
+
+
+async def is_pinned(viewset_class, request) -> bool:
+    """Anonymous requests cannot be pinned, they skip the hop to the pool"""
+    if not has_credentials(request):
+        return False
+    return await run_blocking(authenticate, viewset_class, request)
+
+
+def render(context) -> HttpResponse:
+    return HttpResponse(ORJSONRenderer().render(context), content_type='application/json', status=context['status'])
+
+
+def build_list_context(viewset_class, request, error_message, primary=False):
+    context = {'status': status.HTTP_400_BAD_REQUEST}
+    if primary:
+        # run_blocking runs this in a copy of the request context, the pin ends with the call
+        pin_to_primary()
+    try:
+        view = get_viewset(viewset_class, request)
+        context.update({"status": status.HTTP_200_OK, "message": "OK", "data": view.get_list_data()})
+    except Exception as ex:
+        context.update({'status': status.HTTP_400_BAD_REQUEST, 'message': str(ex)})
+        logger.error(f'{error_message} due to {format_exc(ex)}')
+    return context
+
+
+@require_get
+async def post_list(request):
+    """
+    Async variant of PostViewSet.list, pages are cached under the post cache generation
+    so the same writes that invalidate the sync list invalidate this one. Like the sync list,
+    pages are built from the primary and users pinned to it after a write bypass the cache
+    """
+    pinned = await is_pinned(PostViewSet, request)
+    encoding = negotiate_request_encoding(request)
+    cached = cache_key = None
+    if not pinned:
+        generation = await async_get_cache_generation(POST_CACHE_PREFIX)
+        digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        # one entry per coding, a hit is sent as stored
+        cache_key = f'{POST_CACHE_PREFIX}.{generation}.async.{digest}.{encoding}'
+        cached = await async_cache_get(cache_key)
+        record_cache_lookup(POST_CACHE_PREFIX, cached is not None)
+    if cached is not None:
+        body, content_encoding = cached
+        response = HttpResponse(body, content_type='application/json', status=status.HTTP_200_OK)
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+    else:
+        context = await run_blocking(build_list_context, PostViewSet, request,
+                                     'Something went wrong while fetching user post', primary=True)
+        response = compress_response(render(context), encoding)
+        if cache_key is not None and context['status'] == status.HTTP_200_OK:
+            await async_cache_set(cache_key, (response.content, response.get('Content-Encoding')),
+                                  timeout=POST_LIST_CACHE_TIMEOUT)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def build_post_context(request, pk, version):
+    context = {"status": status.HTTP_200_OK}
+    # the payload fills the detail cache shared by every reader
+    pin_to_primary()
+    try:
+        view = get_viewset(PostViewSet, request, pk=pk)
+        context.update({"data": view.cache_post(view.get_object(), version)})
+    except Exception as ex:
+        context.update({"status": status.HTTP_400_BAD_REQUEST, "message": str(ex)})
+    return context
+
+
+@require_get
+async def post_retrieve(request, pk):
+    """Async variant of PostViewSet.retrieve, sharing its write-through payload cache"""
+    version_key = get_version_key(POST_CACHE_PREFIX, pk)
+    version = await async_cache_get(version_key)
+    if version is None:
+        version = (await run_blocking(get_versions, version_key))[0]
+    entry = await async_cache_get(get_object_cache_key(POST_CACHE_PREFIX, pk))
+    hit = entry is not None and entry['version'] == version
+    record_cache_lookup(f'{POST_CACHE_PREFIX}.detail', hit)
+    if hit:
+        return render({"status": status.HTTP_200_OK, "data": entry['value']})
+    return render(await run_blocking(build_post_context, request, pk, version))
+
+
+@require_get
+async def comment_list(request):
+    """Async variant of PostCommentViewSet.list"""
+    return render(await run_blocking(build_list_context, PostCommentViewSet, request,
+                                     'Something went wrong while fetching post comment',
+                                     await is_pinned(PostCommentViewSet, request)))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.views import PostViewSet, PostCommentViewSet
+from services.export import DEFAULT_EXPORT_CHUNK_SIZE, EXPORT_CONTENT_TYPES, iter_export
+
+EXPORTS = {
+    'posts': PostViewSet,
+    'comments': PostCommentViewSet,
+}
+
+
+class Command(BaseCommand):
+    help = 'Streams posts or comments to a file (or stdout) as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=list(EXPORTS))
+        parser.add_argument('--format', dest='export_format', choices=list(EXPORT_CONTENT_TYPES), default='ndjson')
+        parser.add_argument('--output', help='Destination file, defaults to stdout')
+        parser.add_argument('--filter', action='append', default=[], metavar='FIELD=VALUE',
+                            help='Filter supported by the matching list endpoint, e.g. --filter publish=1')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        view = EXPORTS[options['resource']]
+        filters = {}
+        for item in options['filter']:
+            field, _, value = item.partition('=')
+            if field not in view.filterset_fields:
+                raise CommandError(f'Unsupported filter ({field}), use one of {", ".join(view.filterset_fields)}')
+            filters[field] = value
+        filterset = view.custom_filter_class.get_filterset_class(view, view.queryset)(
+            data=filters, queryset=view.queryset)
+        if not filterset.is_valid():
+            raise CommandError(f'Invalid filter {dict(filterset.errors)}')
+        chunks = iter_export(filterset.qs, view.export_fields, options['export_format'],
+                             chunk_size=options['chunk_size'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='') as stream:
+            for chunk in chunks:
+                stream.write(chunk)
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from core.models import Comment
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the materialized path, depth and reply count of every comment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            Comment.objects.update(path='', depth=0)
+            # a level is every comment not yet visited whose parent has been visited
+            level = Comment.objects.filter(parent_comment__isnull=True)
+            depth = total = 0
+            while True:
+                batch, visited = [], 0
+                queryset = level.select_related('parent_comment').annotate(replies=Count('comment'))
+                for comment in queryset.iterator(chunk_size=batch_size):
+                    parent_path = comment.parent_comment.path if comment.parent_comment_id else ''
+                    comment.path = Comment.build_path(comment.id, parent_path)
+                    comment.depth = depth
+                    comment.reply_count = comment.replies
+                    batch.append(comment)
+                    if len(batch) >= batch_size:
+                        visited += self.flush(batch, batch_size)
+                visited += self.flush(batch, batch_size)
+                if not visited:
+                    break
+                total += visited
+                depth += 1
+                level = Comment.objects.filter(path='').exclude(parent_comment__path='')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} comments across {depth} levels'))
+
+    @staticmethod
+    def flush(batch, batch_size):
+        count = len(batch)
+        if count:
+            Comment.objects.bulk_update(batch, ['path', 'depth', 'reply_count'], batch_size=batch_size)
+            batch.clear()
+        return count
@@ -0,0 +1,32 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.models import Post, Comment
+from services.cache import POST_CACHE_PREFIX, get_object_cache_key, get_version_key
+
+
+class Command(BaseCommand):
+    help = 'Recounts the comments of every post whose comment_count has drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drifted posts')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        counts = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(
+            total=Count('id')).values('total')
+        actual = Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+        drifted = Post.objects.annotate(actual=actual).exclude(comment_count=F('actual')).order_by('id')
+        post_ids = list(drifted.values_list('id', flat=True))
+        if options['dry_run']:
+            self.stdout.write(f'{len(post_ids)} posts have drifted: {post_ids}')
+            return
+        for start in range(0, len(post_ids), batch_size):
+            batch = post_ids[start:start + batch_size]
+            Post.objects.filter(id__in=batch).update(comment_count=actual)
+            cache.delete_many([get_object_cache_key(POST_CACHE_PREFIX, post_id) for post_id in batch] +
+                              [get_version_key(POST_CACHE_PREFIX, post_id) for post_id in batch])
+        self.stdout.write(self.style.SUCCESS(f'Repaired comment count of {len(post_ids)} posts'))
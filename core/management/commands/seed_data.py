@@ -0,0 +1,132 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.text import slugify
+from faker import Faker
+
+from core.models import User, Post, Comment
+from services.cache import POST_CACHE_PREFIX, bump_cache_generation
+from services.utility import generate_time_ordered_uuid
+
+SEED_EMAIL_TEMPLATE = 'seed-user-{index}@example.com'
+SEED_PASSWORD = 'seed-password'
+TEXT_POOL_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Seeds users, posts and threaded comments in bulk for load tests and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=100000)
+        parser.add_argument('--reply-ratio', type=float, default=0.5,
+                            help='Replies created per comment of the level above, 0 keeps every comment top level')
+        parser.add_argument('--max-depth', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1, help='Same seed, same dataset')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['reply_ratio'] < 1:
+            raise CommandError('--reply-ratio must be in [0, 1)')
+        self.random = random.Random(options['seed'])
+        fake = Faker()
+        fake.seed_instance(options['seed'])
+        # faker is far slower than the inserts, rows draw their text from a fixed pool
+        self.sentences = [fake.sentence() for _ in range(TEXT_POOL_SIZE)]
+        self.paragraphs = [' '.join(fake.sentences(5)) for _ in range(TEXT_POOL_SIZE)]
+        self.names = [(fake.first_name(), fake.last_name()) for _ in range(TEXT_POOL_SIZE)]
+        batch_size = options['batch_size']
+        self.reserved_ids, self.reserve_size = [], batch_size
+
+        user_ids = self.seed_users(options['users'], batch_size)
+        post_ids = self.seed_posts(options['posts'], user_ids, batch_size)
+        comment_count = self.seed_comments(options['comments'], post_ids, user_ids, options['reply_ratio'],
+                                           options['max_depth'], batch_size)
+        bump_cache_generation(POST_CACHE_PREFIX)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(user_ids)} users, {len(post_ids)} posts and {comment_count} comments'))
+
+    def seed_users(self, total, batch_size) -> list:
+        # hashing is the slow part of creating a user, every seeded account shares one hash
+        password = make_password(SEED_PASSWORD)
+        offset = User.objects.filter(email__startswith='seed-user-').count()
+        user_ids = []
+        for start in range(0, total, batch_size):
+            users = []
+            for index in range(offset + start, offset + min(start + batch_size, total)):
+                first_name, last_name = self.random.choice(self.names)
+                users.append(User(username=generate_time_ordered_uuid(), password=password,
+                                  email=SEED_EMAIL_TEMPLATE.format(index=index),
+                                  first_name=first_name, last_name=last_name))
+            user_ids += [user.id for user in User.objects.bulk_create(users)]
+        return user_ids
+
+    def seed_posts(self, total, user_ids, batch_size) -> list:
+        if not user_ids:
+            raise CommandError('Posts need at least one user, use --users')
+        post_ids = []
+        for start in range(0, total, batch_size):
+            posts = []
+            for index in range(start, min(start + batch_size, total)):
+                # the index keeps (user, title) unique however small the text pool is
+                title = f'{self.random.choice(self.sentences)[:-1]} {index}'
+                posts.append(Post(user_id=self.random.choice(user_ids), title=title, slug=slugify(title),
+                                  description=self.random.choice(self.paragraphs),
+                                  publish=self.random.random() < 0.8))
+            post_ids += [post.id for post in Post.objects.bulk_create(posts)]
+        return post_ids
+
+    def seed_comments(self, total, post_ids, user_ids, reply_ratio, max_depth, batch_size) -> int:
+        """
+        Every batch is a forest of top level comments and their replies, ids are reserved up front
+        so path, depth and reply_count are written with the insert instead of being rebuilt afterwards
+        """
+        if total and not post_ids:
+            raise CommandError('Comments need at least one post, use --posts')
+        per_thread = sum(reply_ratio ** depth for depth in range(max_depth + 1))
+        created = 0
+        while created < total:
+            roots = max(1, min(batch_size, int((total - created) / per_thread)))
+            levels = [[self.build_comment(post_id=self.random.choice(post_ids), user_ids=user_ids)
+                       for _ in range(roots)]]
+            remaining = total - created - roots
+            for _ in range(max_depth):
+                replies = min(remaining, int(len(levels[-1]) * reply_ratio))
+                if replies <= 0:
+                    break
+                levels.append([self.build_comment(parent=self.random.choice(levels[-1]), user_ids=user_ids)
+                               for _ in range(replies)])
+                remaining -= replies
+            with transaction.atomic():
+                for level in levels:
+                    Comment.objects.bulk_create(level, batch_size=batch_size)
+            created += sum(len(level) for level in levels)
+        # bulk_create sends no post_save, so comment_count is recounted from the table once at the end
+        call_command('repair_comment_counts', stdout=self.stdout)
+        return created
+
+    def build_comment(self, user_ids, post_id=None, parent=None) -> Comment:
+        comment_id = self.reserve_comment_id()
+        comment = Comment(id=comment_id, user_id=self.random.choice(user_ids), body=self.random.choice(self.sentences))
+        if parent is None:
+            comment.post_id = post_id
+            comment.path = Comment.build_path(comment_id)
+        else:
+            comment.post_id = parent.post_id
+            comment.parent_comment_id = parent.id
+            comment.path = Comment.build_path(comment_id, parent.path)
+            comment.depth = parent.depth + 1
+            parent.reply_count += 1
+        return comment
+
+    def reserve_comment_id(self) -> int:
+        if not self.reserved_ids:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                               [Comment._meta.db_table, self.reserve_size])
+                self.reserved_ids = [row[0] for row in cursor.fetchall()][::-1]
+        return self.reserved_ids.pop()
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Replaces the unique constraint on email with a unique index on LOWER(email), so accounts differing only by
+    the case of their email are rejected however the row is written (bulk_create, update, raw SQL). Django 3.2
+    cannot declare a functional unique constraint on the model, the index keeps the constraint's name
+    """
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='user',
+            name='user_email_unique',
+        ),
+        migrations.RunSQL(
+            sql="CREATE UNIQUE INDEX user_email_unique ON core_user (LOWER(email)) WHERE email <> ''",
+            reverse_sql='DROP INDEX user_email_unique',
+        ),
+    ]
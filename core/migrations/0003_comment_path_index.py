@@ -0,0 +1,29 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Lets the composite indexes serve the comment lookups: drops the single column indexes on comment.post_id and
+    comment.path, which the planner preferred over the composites holding the same columns, and compares paths in
+    the C collation so subtree ranges and the thread order are read from comment_post_path_idx
+    """
+
+    dependencies = [
+        ('core', '0002_user_email_lower_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='post',
+            field=models.ForeignKey(blank=True, db_index=False, null=True,
+                                    on_delete=django.db.models.deletion.CASCADE, related_name='comments',
+                                    to='core.post'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(db_collation='C', default='', editable=False, max_length=1024),
+        ),
+    ]
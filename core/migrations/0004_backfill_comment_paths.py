@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# every level adds the zero padded id and a slash, like Comment.build_path. Chains deeper than Comment.MAX_DEPTH
+# would not fit in the column and keep an empty path, which the views handle without a prefix
+BACKFILL_COMMENT_PATHS = """
+WITH RECURSIVE tree (id, path, depth) AS (
+    SELECT id, LPAD(id::text, 10, '0') || '/', 0 FROM core_comment WHERE parent_comment_id IS NULL
+    UNION ALL
+    SELECT comment.id, tree.path || LPAD(comment.id::text, 10, '0') || '/', tree.depth + 1
+    FROM core_comment comment JOIN tree ON comment.parent_comment_id = tree.id
+    WHERE tree.depth < 92
+)
+UPDATE core_comment SET path = tree.path, depth = tree.depth,
+    reply_count = (SELECT COUNT(*) FROM core_comment reply WHERE reply.parent_comment_id = core_comment.id)
+FROM tree WHERE core_comment.id = tree.id AND core_comment.path = ''
+"""
+
+
+def backfill_comment_paths(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(BACKFILL_COMMENT_PATHS)
+
+
+class Migration(migrations.Migration):
+    """
+    Fills in the path, depth and reply count of comments written before they were maintained on save, an empty
+    path would make a comment's subtree the whole post
+    """
+
+    dependencies = [
+        ('core', '0003_comment_path_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_comment_paths, migrations.RunPython.noop),
+    ]
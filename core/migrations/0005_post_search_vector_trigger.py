@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# the same vector as SearchVector('title', weight='A') + SearchVector('description', weight='B') in the
+# 'english' configuration (Post.SEARCH_CONFIG)
+CREATE_TRIGGER = """
+CREATE FUNCTION core_post_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english'::regconfig, COALESCE(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english'::regconfig, COALESCE(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_post_search_vector BEFORE INSERT OR UPDATE OF title, description, search_vector ON core_post
+FOR EACH ROW EXECUTE FUNCTION core_post_search_vector();
+
+UPDATE core_post SET search_vector = NULL WHERE search_vector IS NULL;
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER core_post_search_vector ON core_post;
+DROP FUNCTION core_post_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+    """
+    Computes post.search_vector in the statement writing the title or description, whichever path writes them:
+    save(), queryset updates, bulk_create or raw SQL. The update fills the rows no write path had filled yet
+    """
+
+    dependencies = [
+        ('core', '0004_backfill_comment_paths'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGER, reverse_sql=DROP_TRIGGER),
+    ]
@@ -1,35 +1,71 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models.functions import Lower
 
 from django.utils.text import slugify
 
 
+models.EmailField.register_lookup(Lower)
+
 
 class User(AbstractUser):
     address = models.TextField(default="", null=True, blank=True)
     avatar = models.ImageField(upload_to="profile", null=True, blank=True)
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now=True, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'{self.get_full_name()} - {self.email}'
 
+    @staticmethod
+    def normalize_email_address(email):
+        """
+        Emails are stored lower-cased, but the uniqueness does not rely on it: non blank emails are unique
+        regardless of case through the user_email_unique index on LOWER(email) from migration 0002. Lookups by
+        email go through email__lower and exclude blank emails, so that partial index serves them
+        """
+        return (email or '').strip().lower()
+
+    def save(self, *args, **kwargs):
+        self.email = self.normalize_email_address(self.email)
+        return super().save(*args, **kwargs)
+
 
 class Post(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="%(class)s")
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, null=True, blank=True)
     image = models.ImageField(upload_to='blog')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     description = models.TextField(default='')
     publish = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now=True, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # written by the core_post_search_vector trigger (migration 0005) whenever title or description are
+    search_vector = SearchVectorField(null=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
 
+    SEARCH_CONFIG = 'english'
+
     def __str__(self):
         return f"{self.id} {self.title}"
 
     class Meta:
         verbose_name_plural = 'Posts'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'title'], name='post_user_title_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_at_id_idx'),
+            # list filters: user__id, publish or both, always ordered by newest first
+            models.Index(fields=['user', 'publish', '-created_at'], name='post_user_publish_created_idx'),
+            models.Index(fields=['publish', '-created_at'], name='post_publish_created_idx'),
+            GinIndex(fields=['search_vector'], name='post_search_vector_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.title:
@@ -38,13 +74,24 @@ class Post(models.Model):
 
 
 class Comment(models.Model):
-    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments", null=True, blank=True)
+    # post and path are only looked up together, through comment_post_path_idx and comment_post_timestamp_idx.
+    # Single column indexes on them would be smaller copies the planner prefers over the composites
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments", null=True, blank=True,
+                             db_index=False)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="%(class)s", null=True, blank=True)
     parent_comment = models.ForeignKey('self', on_delete=models.CASCADE, related_name="%(class)s", null=True,
                                        blank=True)
     body = models.TextField(default='')
+    # compared byte by byte, so comment_post_path_idx serves both the thread order and subtree prefix ranges
+    path = models.CharField(max_length=1024, default='', editable=False, db_collation='C')
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
     timestamp = models.DateTimeField(auto_now=True, editable=False)
 
+    PATH_STEP_LENGTH = 10
+    # every level adds its zero padded id and a slash to the path, deeper replies would not fit in the column
+    MAX_DEPTH = path.max_length // (PATH_STEP_LENGTH + 1) - 1
+
     def __str__(self):
         parent_id = self.parent_comment.id if self.parent_comment is not None else ''
         name = f'{self.body}' if self.post is not None else f'<Comment Reply> #{parent_id}'
@@ -52,5 +99,35 @@ class Comment(models.Model):
 
     class Meta:
         verbose_name_plural = 'Comments'
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+            models.Index(fields=['post', 'timestamp'], name='comment_post_timestamp_idx'),
+        ]
+
+    # sorts after every digit and slash, paths below P are the ones between P and P + PATH_UPPER_BOUND
+    PATH_UPPER_BOUND = '~'
+
+    @classmethod
+    def build_path(cls, comment_id, parent_path=''):
+        return f'{parent_path}{comment_id:0{cls.PATH_STEP_LENGTH}d}/'
+
+    def save(self, *args, **kwargs):
+        # held locally, save() drops the cached parent when parent_comment_id was assigned as a string
+        parent = self.parent_comment if self.parent_comment_id else None
+        if parent is not None and self.post_id is None:
+            # replies belong to the same post as the comment they answer
+            self.post_id = parent.post_id
+        created = self._state.adding
+        if created and parent is not None and parent.depth >= self.MAX_DEPTH:
+            raise ValidationError(f'Replies can be nested at most {self.MAX_DEPTH} levels deep')
+        # the path is only known once the row has its id, a comment is never left without one
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            response = super().save(*args, **kwargs)
+            if created:
+                parent_path = parent.path if parent is not None else ''
+                self.path = self.build_path(self.id, parent_path)
+                self.depth = self.path.count('/') - 1
+                Comment.objects.filter(id=self.id).update(path=self.path, depth=self.depth)
+        return response
 
 
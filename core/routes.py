@@ -1,8 +1,17 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
+from core.async_views import post_list, post_retrieve, comment_list
 from core.views import AuthViewSet, PostViewSet, PostCommentViewSet
 
 router = DefaultRouter()
 router.register(r"auth", AuthViewSet, basename="auth-api")
 router.register(r"post/comment", PostCommentViewSet, basename="comment-api")
 router.register(r"post", PostViewSet, basename="post-api")
+
+# async read path, served without holding a worker thread when running under ASGI
+async_urlpatterns = [
+    path("post/comment/", comment_list, name="async-comment-list"),
+    path("post/", post_list, name="async-post-list"),
+    path("post/<int:pk>/", post_retrieve, name="async-post-detail"),
+]
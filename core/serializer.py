@@ -1,29 +1,62 @@
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 
 from core.models import User, Post, Comment
-from services.utility import generate_uuid
+from services.cache import COMMENT_CACHE_PREFIX, POST_CACHE_PREFIX, bump_cache_generation, get_version_key, \
+    invalidate_versions
+from services.images import get_variant_urls
+from services.serialization import ValuesSerializer
+from services.utility import generate_time_ordered_uuid
 
 
 class UserSerializer(serializers.ModelSerializer):
+    avatar_variants = serializers.SerializerMethodField('get_avatar_variants')
+
     class Meta:
         model = User
-        fields = ['id', 'first_name', 'last_name', 'email', 'address']
+        fields = ['id', 'first_name', 'last_name', 'email', 'address', 'avatar_variants']
+
+    values_fields = {'avatar_variants': ('avatar_variants', get_variant_urls)}
+
+    @staticmethod
+    def get_avatar_variants(obj):
+        return get_variant_urls(obj.avatar_variants)
+
+
+def get_post_image_url(name) -> str:
+    if name:
+        return f'{settings.BASE_URL}{Post.image.field.storage.url(name)}'
+    return ''
 
 
 class PostSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     image = serializers.SerializerMethodField('get_image')
+    image_variants = serializers.SerializerMethodField('get_image_variants')
 
     class Meta:
         model = Post
-        fields = ['id', 'user', 'title', 'slug', 'description', 'image', 'publish','created_at']
+        fields = ['id', 'user', 'title', 'slug', 'description', 'image', 'image_variants', 'publish',
+                  'comment_count', 'created_at']
+
+    values_fields = {
+        'image': ('image', get_post_image_url),
+        'image_variants': ('image_variants', get_variant_urls),
+    }
 
     @staticmethod
     def get_image(obj):
-        if obj.image:
-            return f'{settings.BASE_URL}{obj.image.url}'
-        return ''
+        return get_post_image_url(obj.image.name)
+
+    @staticmethod
+    def get_image_variants(obj):
+        return get_variant_urls(obj.image_variants)
+
+
+class PostValuesSerializer(ValuesSerializer):
+    """PostSerializer's output for rows fetched with `.values(*PostValuesSerializer.get_columns())`"""
+    serializer_class = PostSerializer
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -33,6 +66,29 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = ['id', 'parent_comment_id', 'post_id', 'user_id', 'body', 'timestamp']
 
 
+class CommentThreadSerializer(CommentSerializer):
+    class Meta:
+        model = Comment
+        fields = ['id', 'parent_comment_id', 'post_id', 'user_id', 'body', 'timestamp', 'depth', 'reply_count']
+
+    @classmethod
+    def build_tree(cls, comments):
+        """
+        Nests comments ordered by their materialized path, nodes whose parent was not
+        fetched (e.g. the root of a subtree) are returned at the top level
+        """
+        nodes, tree = {}, []
+        for comment in comments:
+            node = dict(cls(comment).data, replies=[])
+            nodes[comment.id] = node
+            parent = nodes.get(comment.parent_comment_id)
+            if parent is None:
+                tree.append(node)
+            else:
+                parent['replies'].append(node)
+        return tree
+
+
 class UserRegisterFormSerializer(serializers.Serializer):
     first_name = serializers.CharField(required=True)
     last_name = serializers.CharField(required=True)
@@ -41,24 +97,29 @@ class UserRegisterFormSerializer(serializers.Serializer):
     password = serializers.CharField(required=True)
 
     def create(self, validated_data):
-        instance = User.objects.create_user(username=generate_uuid(User, 'username'),
-                                            email=validated_data.get('email'),
-                                            password=validated_data.get('password'),
-                                            **{
-                                                'first_name': validated_data.get('first_name', ''),
-                                                'last_name': validated_data.get('last_name', ''),
-                                                'address': validated_data.get('address', ''),
-                                            })
+        """
+        Email uniqueness is enforced by the case-insensitive user_email_unique index, so an account costs
+        a single INSERT
+        """
+        try:
+            with transaction.atomic():
+                instance = User.objects.create_user(username=generate_time_ordered_uuid(),
+                                                    email=validated_data.get('email'),
+                                                    password=validated_data.get('password'),
+                                                    **{
+                                                        'first_name': validated_data.get('first_name', ''),
+                                                        'last_name': validated_data.get('last_name', ''),
+                                                        'address': validated_data.get('address', ''),
+                                                    })
+        except IntegrityError as ex:
+            if 'user_email_unique' in str(ex):
+                raise serializers.ValidationError({'non_field_errors': ['Email already exist']})
+            raise
         return instance
 
     def update(self, instance, validated_data):
         pass
 
-    def validate(self, attrs):
-        if User.objects.filter(email=attrs.get('email')).exists() is True:
-            raise serializers.ValidationError('Email already exist')
-        return attrs
-
 
 class LoginFormSerializer(serializers.Serializer):
     username = serializers.CharField(required=True, help_text='Username could be either customer email or system '
@@ -78,19 +139,38 @@ class PostFormSerializer(serializers.Serializer):
     image = serializers.ImageField(required=False)
     publish = serializers.BooleanField(required=False)
 
+    @staticmethod
+    def raise_for_duplicate_title(ex: IntegrityError):
+        if 'post_user_title_unique' in str(ex):
+            raise serializers.ValidationError('Post with this title already exist inside your account')
+        raise ex
+
     def create(self, validated_data):
+        """Title uniqueness per user is enforced by the post_user_title_unique constraint"""
         validated_data.update({
             'image': self.context["request"].FILES['image']
         })
-        instance = Post.objects.create(**validated_data)
+        try:
+            with transaction.atomic():
+                instance = Post.objects.create(**validated_data)
+        except IntegrityError as ex:
+            self.raise_for_duplicate_title(ex)
         return instance
 
     def update(self, instance, validated_data):
-        _ = Post.objects.filter(id=instance.id).update(**validated_data)
-        instance.refresh_from_db()
+        try:
+            with transaction.atomic():
+                _ = Post.objects.filter(id=instance.id).update(**validated_data)
+        except IntegrityError as ex:
+            self.raise_for_duplicate_title(ex)
+        # only reload what was written, a full refresh would also drop the prefetched author
+        instance.refresh_from_db(fields=list(validated_data))
         if self.context["request"].FILES.get('image'):
             instance.image = self.context["request"].FILES['image']
             instance.save(update_fields=['image'])
+        else:
+            # queryset update does not send post_save
+            bump_cache_generation(POST_CACHE_PREFIX)
         return instance
 
 
@@ -99,24 +179,41 @@ class CommentFormSerializer(serializers.Serializer):
     parent_comment_id = serializers.CharField(required=False)
     body = serializers.CharField(required=True)
 
+    TREE_FIELDS = ('post_id', 'parent_comment_id')
+
     def create(self, validated_data):
         instance = Comment.objects.create(**validated_data)
         return instance
 
     def update(self, instance, validated_data):
+        # validate() only lets the comment's own post and parent through, its place in the tree is left as is
+        validated_data = {key: value for key, value in validated_data.items() if key not in self.TREE_FIELDS}
         _ = Comment.objects.filter(id=instance.id).update(**validated_data)
         instance.refresh_from_db()
+        # queryset update does not send post_save
+        invalidate_versions(get_version_key(COMMENT_CACHE_PREFIX, instance.post_id))
         return instance
 
     def validate(self, attrs):
         if bool(attrs.get('post_id')) is False and bool(attrs.get('parent_comment_id')) is False:
             raise serializers.ValidationError('Kindly supply either post_id or parent_comment_id to add a comment')
 
+        if self.instance is not None:
+            # moving a comment would leave its subtree's paths, depths and the counters of both posts behind
+            for field in self.TREE_FIELDS:
+                if bool(attrs.get(field)) and str(attrs.get(field)) != str(getattr(self.instance, field)):
+                    raise serializers.ValidationError(f'A comment cannot be moved, {field} must stay '
+                                                      f'{getattr(self.instance, field)}')
+            return attrs
+
         if bool(attrs.get('post_id')):
             if Post.objects.filter(id=attrs.get('post_id')).exists() is False:
                 raise serializers.ValidationError(f"Supply post id ({attrs.get('post_id')}) does not exist")
         if bool(attrs.get('parent_comment_id')):
-            if Comment.objects.filter(id=attrs.get('parent_comment_id')).exists() is False:
+            depth = Comment.objects.filter(id=attrs.get('parent_comment_id')).values_list('depth', flat=True).first()
+            if depth is None:
                 raise serializers.ValidationError(f"Supply parent comment id "
                                                   f"({attrs.get('parent_comment_id')}) does not exist")
+            if depth >= Comment.MAX_DEPTH:
+                raise serializers.ValidationError(f'Replies can be nested at most {Comment.MAX_DEPTH} levels deep')
         return attrs
@@ -1,18 +1,183 @@
 import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from django.core.cache import cache
 from django.dispatch import receiver
-from django.db import models
-from traceback_with_variables import format_exc
+from django.db import models, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
-from core.models import Post
+from core.models import User, Post, Comment
+from core.serializer import UserSerializer
+from services.cache import COMMENT_CACHE_PREFIX, POST_CACHE_PREFIX, USER_CACHE_PREFIX, bump_cache_generation, \
+    get_object_cache_key, get_version_key, invalidate_versions
+from services.images import schedule_image_variants, variants_are_stale
+from services.log import format_exc
 
 logger = logging.getLogger('core')
 
+# set while deferred_comment_counters() collects the counters a cascade delete touched
+_deferred_counters = ContextVar('deferred_comment_counters', default=None)
+
+USER_SERIALIZED_FIELDS = frozenset(UserSerializer.Meta.fields)
+
 
+@receiver(models.signals.post_save, sender=Post)
 @receiver(models.signals.post_delete, sender=Post)
-def auto_delete_image_on_change_user(sender, instance, **kwargs):
+def invalidate_post_cache_on_change(sender, instance, **kwargs):
     try:
-        cache.delete_many(keys=cache.keys('*.post.*'))
+        bump_cache_generation(POST_CACHE_PREFIX)
+        cache.delete_many([get_object_cache_key(POST_CACHE_PREFIX, instance.id),
+                           get_version_key(POST_CACHE_PREFIX, instance.id)])
     except Exception as ex:
-        logger.error(f'Something went wrong while deleting cache due to {str(ex)}')
+        logger.error(f'Something went wrong while invalidating post cache due to {str(ex)}')
         logger.error(format_exc(ex))
+
+
+@receiver(models.signals.post_save, sender=User)
+@receiver(models.signals.post_delete, sender=User)
+def evict_cached_user_on_change(sender, instance, **kwargs):
+    try:
+        cache.delete(get_object_cache_key(USER_CACHE_PREFIX, instance.id))
+    except Exception as ex:
+        logger.error(f'Something went wrong while evicting <{instance.id}> cached user due to {str(ex)}')
+
+
+@receiver(models.signals.post_save, sender=User)
+def invalidate_user_post_cache_on_change(sender, instance, created, update_fields=None, **kwargs):
+    """Cached post payloads embed the author, evict them when any serialized user field may have changed"""
+    if created or (update_fields is not None and USER_SERIALIZED_FIELDS.isdisjoint(update_fields)):
+        return
+    evict_user_post_cache(instance)
+
+
+def evict_user_post_cache(user):
+    try:
+        post_ids = Post.objects.filter(user=user).values_list('id', flat=True)
+        cache.delete_many([get_object_cache_key(POST_CACHE_PREFIX, post_id) for post_id in post_ids] +
+                          [get_version_key(POST_CACHE_PREFIX, post_id) for post_id in post_ids])
+    except Exception as ex:
+        logger.error(f'Something went wrong while invalidating <{user.id}> user post cache due to {str(ex)}')
+        logger.error(format_exc(ex))
+
+
+def evict_user_caches(user):
+    """The variants are recorded with a queryset update, which sends no save signal to evict the cached user"""
+    evict_cached_user_on_change(User, user)
+    evict_user_post_cache(user)
+
+
+@receiver(models.signals.post_save, sender=Post)
+def schedule_post_image_variants(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if variants_are_stale(instance.image, instance.image_variants):
+        schedule_image_variants(Post, instance.id, 'image', 'image_variants',
+                                on_complete=lambda post: invalidate_post_cache_on_change(Post, post))
+
+
+@receiver(models.signals.post_save, sender=User)
+def schedule_user_avatar_variants(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    if variants_are_stale(instance.avatar, instance.avatar_variants):
+        schedule_image_variants(User, instance.id, 'avatar', 'avatar_variants', on_complete=evict_user_caches)
+
+
+@receiver(models.signals.post_save, sender=Comment)
+def increment_reply_count_on_comment_create(sender, instance, created, **kwargs):
+    if created and instance.parent_comment_id:
+        Comment.objects.filter(id=instance.parent_comment_id).update(reply_count=F('reply_count') + 1)
+
+
+@receiver(models.signals.post_delete, sender=Comment)
+def decrement_reply_count_on_comment_delete(sender, instance, **kwargs):
+    deferred = _deferred_counters.get()
+    if deferred is not None:
+        deferred['deleted'].add(instance.id)
+        if instance.parent_comment_id:
+            deferred['parents'].add(instance.parent_comment_id)
+        return
+    if instance.parent_comment_id:
+        Comment.objects.filter(id=instance.parent_comment_id, reply_count__gt=0).update(
+            reply_count=F('reply_count') - 1)
+
+
+def evict_post_detail_cache(*post_ids):
+    """
+    The list cache is left to expire on its own timeout, bumping its generation on every
+    comment would defeat it for busy posts. The ETag version of the post changes, the list ETag
+    is hashed from the cached page and changes once a fresh page is rendered
+    """
+    try:
+        cache.delete_many([get_object_cache_key(POST_CACHE_PREFIX, post_id) for post_id in post_ids] +
+                          [get_version_key(POST_CACHE_PREFIX, post_id) for post_id in post_ids])
+    except Exception as ex:
+        logger.error(f'Something went wrong while evicting <{post_ids}> post cache due to {str(ex)}')
+
+
+@receiver(models.signals.post_save, sender=Comment)
+def increment_comment_count_on_comment_create(sender, instance, created, **kwargs):
+    if created and instance.post_id:
+        Post.objects.filter(id=instance.post_id).update(comment_count=F('comment_count') + 1)
+        evict_post_detail_cache(instance.post_id)
+
+
+@receiver(models.signals.post_delete, sender=Comment)
+def decrement_comment_count_on_comment_delete(sender, instance, **kwargs):
+    """Cascaded replies of a deleted comment each send post_delete, so every row is accounted for"""
+    deferred = _deferred_counters.get()
+    if deferred is not None and instance.post_id:
+        deferred['posts'].add(instance.post_id)
+    elif instance.post_id:
+        Post.objects.filter(id=instance.post_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
+        evict_post_detail_cache(instance.post_id)
+
+
+@receiver(models.signals.post_save, sender=Comment)
+@receiver(models.signals.post_delete, sender=Comment)
+def invalidate_comment_version_on_change(sender, instance, **kwargs):
+    if instance.post_id and _deferred_counters.get() is None:
+        try:
+            invalidate_versions(get_version_key(COMMENT_CACHE_PREFIX, instance.post_id))
+        except Exception as ex:
+            logger.error(f'Something went wrong while invalidating <{instance.post_id}> comment version '
+                         f'due to {str(ex)}')
+
+
+def recount_comment_counters(post_ids, parent_ids):
+    """One UPDATE per counter for the posts and comments a cascade deleted comments from"""
+    if post_ids:
+        comments = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(
+            total=Count('id')).values('total')
+        Post.objects.filter(id__in=post_ids).update(
+            comment_count=Coalesce(Subquery(comments, output_field=IntegerField()), 0))
+    if parent_ids:
+        replies = Comment.objects.filter(parent_comment=OuterRef('pk')).order_by().values('parent_comment').annotate(
+            total=Count('id')).values('total')
+        Comment.objects.filter(id__in=parent_ids).update(
+            reply_count=Coalesce(Subquery(replies, output_field=IntegerField()), 0))
+    if post_ids:
+        evict_post_detail_cache(*post_ids)
+        try:
+            invalidate_versions(*[get_version_key(COMMENT_CACHE_PREFIX, post_id) for post_id in post_ids])
+        except Exception as ex:
+            logger.error(f'Something went wrong while invalidating <{post_ids}> comment versions due to {str(ex)}')
+
+
+@contextmanager
+def deferred_comment_counters():
+    """
+    Deleting a post or a comment sends post_delete for every comment of the cascade. Inside this block the
+    handlers only collect the posts and parent comments the cascade touched, their counters are recounted
+    once the delete is done, in the same transaction, instead of two UPDATEs and a cache round trip per row
+    """
+    touched = {'posts': set(), 'parents': set(), 'deleted': set()}
+    with transaction.atomic(savepoint=False):
+        token = _deferred_counters.set(touched)
+        try:
+            yield
+        finally:
+            _deferred_counters.reset(token)
+        recount_comment_counters(touched['posts'], touched['parents'] - touched['deleted'])
@@ -2,31 +2,54 @@ from datetime import datetime
 
 import pytz
 import logging
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import IntegerField, Subquery, Value
+from django.db.models.functions import Concat
+from django.http import Http404
 from django.shortcuts import redirect, get_object_or_404
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.utils.text import slugify
 from django.views.decorators.vary import vary_on_cookie
 from drf_yasg import openapi
-from silk.profiling.profiler import silk_profile
-from traceback_with_variables import format_exc
 from django.contrib.auth import authenticate, logout
 from django.utils.timezone import make_aware
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ViewSet
 from drf_psq import PsqMixin, Rule, psq
 from core.models import User, Post, Comment
 from core.serializer import UserSerializer, LoginFormSerializer, UserRegisterFormSerializer, PostSerializer, \
-    PostFormSerializer, CommentFormSerializer, CommentSerializer
+    PostFormSerializer, PostValuesSerializer, CommentFormSerializer, CommentSerializer, CommentThreadSerializer
+from core.signal import deferred_comment_counters
 from services.base import BaseViewSet
+from services.cache import COMMENT_CACHE_PREFIX, POST_CACHE_PREFIX, POST_DETAIL_CACHE_TIMEOUT, \
+    bump_cache_generation, get_generation_key, get_object_cache_key, get_version_key, get_versioned, get_versions, \
+    set_versioned, versioned_cache_page
+from services.conditional import etag_on_versions
+from services.log import format_exc
+from services.metrics import record_cache_lookup, serialize
 from services.permissions import global_permission
+from services.routers import pin_to_primary, primary_reads
 from services.utility import error_message_formatter, get_tokens_for_user
 
 logger = logging.getLogger('core')
 
+BULK_CREATE_LIMIT = 5000
+
+
+def get_post_versions(request, *args, **kwargs) -> list:
+    return [get_generation_key(POST_CACHE_PREFIX), get_version_key(POST_CACHE_PREFIX, kwargs.get('pk'))]
+
+
+def get_comment_list_versions(request, *args, **kwargs) -> list:
+    post_id = request.GET.get('post__id')
+    return [get_version_key(COMMENT_CACHE_PREFIX, post_id)] if post_id else []
+
 
 def account_logout(request):
     try:
@@ -38,14 +61,20 @@ def account_logout(request):
 
 class AuthViewSet(ViewSet):
     serializer_class = UserSerializer
+    query_budgets = {'login': 2, 'register': 3}
     permission_classes = [
         AllowAny,
     ]
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # an account is used right after it is created, a lagging replica would reject the first login
+        pin_to_primary()
+
     @staticmethod
     def get_user(username):
         try:
-            user = User.objects.get(email=username)
+            user = User.objects.exclude(email='').get(email__lower=User.normalize_email_address(username))
             return user
         except User.DoesNotExist:
             return None
@@ -104,8 +133,12 @@ class AuthViewSet(ViewSet):
             data = self.get_data(request)
             serializer = UserRegisterFormSerializer(data=data)
             if serializer.is_valid():
-                _ = serializer.create(validated_data=serializer.validated_data)
-                context.update({'status': status.HTTP_201_CREATED, 'message': 'Account created successfully'})
+                try:
+                    _ = serializer.create(validated_data=serializer.validated_data)
+                    context.update({'status': status.HTTP_201_CREATED, 'message': 'Account created successfully'})
+                except ValidationError as ex:
+                    context.update({'errors': error_message_formatter(serializer_errors=ex.detail),
+                                    'status': status.HTTP_400_BAD_REQUEST})
             else:
                 context.update({'errors': error_message_formatter(serializer_errors=serializer.errors),
                                 'status': status.HTTP_400_BAD_REQUEST})
@@ -120,11 +153,18 @@ class AuthViewSet(ViewSet):
 
 class PostViewSet(BaseViewSet):
     serializer_class = PostSerializer
+    list_serializer_class = PostValuesSerializer
     serializer_form_class = PostFormSerializer
-    queryset = Post.objects.select_related('user').all().order_by('-created_at')
+    queryset = Post.objects.select_related('user').defer('search_vector').all().order_by('-created_at')
     filterset_fields = ['user__id', 'publish']
     search_fields = ['title', ]
+    search_vector_field = 'search_vector'
+    search_config = Post.SEARCH_CONFIG
+    export_fields = ['id', 'user_id', 'title', 'slug', 'description', 'image', 'publish', 'comment_count',
+                     'created_at', 'updated_at']
+    export_name = 'posts'
     logger_name = 'core'
+    query_budgets = {'list': 2, 'retrieve': 1, 'export': 2, 'create': 4, 'bulk_create': 5, 'update': 6, 'destroy': 7}
 
     def get_object(self):
         return get_object_or_404(self.queryset, id=self.kwargs.get('pk'))
@@ -132,6 +172,25 @@ class PostViewSet(BaseViewSet):
     def get_queryset(self):
         return self.queryset
 
+    def get_list_data(self):
+        # list pages are fetched as plain rows, list_serializer_class renders them exactly like serializer_class
+        queryset = self.get_list(self.get_queryset()).values(*self.list_serializer_class.get_columns())
+        if 'cursor' in self.request.query_params:
+            return self.get_cursor_paginated_data(queryset=queryset, serializer_class=self.list_serializer_class)
+        return self.get_paginated_data(queryset=queryset, serializer_class=self.list_serializer_class)
+
+    def cache_post(self, instance, version=None):
+        """
+        Serializes the post and writes the payload through to the post detail cache, under the post's version
+        read before the post was (`version`), right after it was written otherwise
+        """
+        data = serialize(self.serializer_class(instance))
+        if version is None:
+            version = get_versions(get_version_key(POST_CACHE_PREFIX, instance.id))[0]
+        set_versioned(get_object_cache_key(POST_CACHE_PREFIX, instance.id), data, version,
+                      timeout=POST_DETAIL_CACHE_TIMEOUT)
+        return data
+
     @swagger_auto_schema(
         operation_description="Display available post",
         operation_summary="List all available post",
@@ -148,31 +207,87 @@ class PostViewSet(BaseViewSet):
                 type=openapi.TYPE_STRING,
                 required=False,
                 description="Filter by publish status",
+            ), openapi.Parameter(
+                "q",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description="Full-text search over post title and description, results are ranked by relevance",
+            ), openapi.Parameter(
+                "cursor",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description="Switch to cursor pagination, supply the `next` token returned by the previous "
+                            "page (leave empty for the first page)",
             )
         ],
     )
-    @method_decorator(cache_page(timeout=60 * 2, key_prefix='post'))
+    @method_decorator(versioned_cache_page(timeout=60 * 2, key_prefix=POST_CACHE_PREFIX))
     @method_decorator(vary_on_cookie)
-    @silk_profile(name='List blog post')
     def list(self, request, *args, **kwargs):
         context = {'status': status.HTTP_400_BAD_REQUEST}
         try:
-            paginate = self.get_paginated_data(queryset=self.get_list(self.get_queryset()),
-                                               serializer_class=self.serializer_class)
-            context.update({"status": status.HTTP_200_OK, "message": "OK", "data": paginate})
+            context.update({"status": status.HTTP_200_OK, "message": "OK", "data": self.get_list_data()})
         except Exception as ex:
             context.update({'status': status.HTTP_400_BAD_REQUEST, 'message': str(ex)})
             self.logger().error(f'Something went wrong while fetching user post due to {format_exc(ex)}')
         return Response(context, status=context['status'])
 
+    @swagger_auto_schema(
+        operation_description="Stream every post matching the list filters as NDJSON or CSV",
+        operation_summary="Export posts",
+        manual_parameters=[
+            openapi.Parameter(
+                "export_format",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=False,
+                enum=["ndjson", "csv"],
+                description="Export format, defaults to ndjson",
+            ), openapi.Parameter(
+                "user__id",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description="Filter by user id",
+            ), openapi.Parameter(
+                "publish",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description="Filter by publish status",
+            )
+        ],
+    )
+    @action(detail=False, methods=["get"], description="Export posts")
+    @method_decorator(global_permission(), name="dispatch")
+    def export(self, request, *args, **kwargs):
+        context = {'status': status.HTTP_400_BAD_REQUEST}
+        try:
+            return self.get_export_response(self.get_list(self.get_queryset()))
+        except Exception as ex:
+            context.update({'message': str(ex)})
+            self.logger().error(f'Something went wrong while exporting post due to {str(ex)}')
+        return Response(context, status=context['status'])
+
     @swagger_auto_schema(
         operation_description="Retrieve post information",
         operation_summary="Retrieve post information",
     )
+    @method_decorator(etag_on_versions(get_post_versions))
     def retrieve(self, request, *args, **kwargs):
         context = {"status": status.HTTP_200_OK}
         try:
-            context.update({"data": self.serializer_class(self.get_object()).data})
+            pk = self.kwargs.get('pk')
+            # a write committing while the payload is built invalidates the version it is stored under
+            data, version = get_versioned(get_object_cache_key(POST_CACHE_PREFIX, pk),
+                                          get_version_key(POST_CACHE_PREFIX, pk))
+            record_cache_lookup(f'{POST_CACHE_PREFIX}.detail', data is not None)
+            if data is None:
+                with primary_reads():
+                    data = self.cache_post(self.get_object(), version)
+            context.update({"data": data})
         except Exception as ex:
             context.update({"status": status.HTTP_400_BAD_REQUEST, "message": str(ex)})
         return Response(context, status=context["status"])
@@ -190,12 +305,11 @@ class PostViewSet(BaseViewSet):
             serializer = self.serializer_form_class(data=data, context={'request': request})
             if serializer.is_valid():
                 serializer.validated_data.update({'user': request.user})
-                if Post.objects.filter(title=serializer.validated_data.get('title'), user=request.user).exists():
-                    context.update({'status': status.HTTP_400_BAD_REQUEST,
-                                    'message': 'Post with this title already exist inside your account'})
-                    return Response(context, status=context['status'])
-                instance = serializer.create(validated_data=serializer.validated_data)
-                context.update({'data': self.serializer_class(instance).data, 'message': 'Post created'})
+                try:
+                    instance = serializer.create(validated_data=serializer.validated_data)
+                    context.update({'data': self.cache_post(instance), 'message': 'Post created'})
+                except ValidationError as ex:
+                    context.update({'status': status.HTTP_400_BAD_REQUEST, 'message': ex.detail[0]})
             else:
                 context.update({
                     'status': status.HTTP_400_BAD_REQUEST,
@@ -207,6 +321,62 @@ class PostViewSet(BaseViewSet):
             self.logger().error(f'<{self.request.user}> error creating post due to {str(ex)}')
         return Response(context, status=context['status'])
 
+    @swagger_auto_schema(
+        operation_description="Add a batch of posts in one request, images are not supported on this endpoint. "
+                              "Each item is reported under its index in the payload",
+        operation_summary="Add a batch of posts",
+        request_body=PostFormSerializer(many=True)
+    )
+    @action(detail=False, methods=["post"], url_path="bulk", description="Add a batch of posts")
+    @method_decorator(global_permission(), name="dispatch")
+    def bulk_create(self, request, *args, **kwargs):
+        context = {'status': status.HTTP_201_CREATED}
+        try:
+            if not isinstance(request.data, list) or len(request.data) > BULK_CREATE_LIMIT:
+                context.update({'status': status.HTTP_400_BAD_REQUEST,
+                                'message': f'Kindly supply a list of at most {BULK_CREATE_LIMIT} posts'})
+                return Response(context, status=context['status'])
+            results, pending = [None] * len(request.data), []
+            for index, item in enumerate(request.data):
+                serializer = self.serializer_form_class(data=item if isinstance(item, dict) else {})
+                if serializer.is_valid():
+                    pending.append((index, serializer.validated_data))
+                else:
+                    results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST,
+                                      'errors': error_message_formatter(serializer.errors)}
+            # one lookup reports duplicates per item, post_user_title_unique still guards concurrent writers
+            existing = set(Post.objects.filter(
+                user=request.user, title__in={data['title'] for _, data in pending}
+            ).values_list('title', flat=True))
+            instances = []
+            for index, data in pending:
+                if data['title'] in existing:
+                    results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST,
+                                      'message': 'Post with this title already exist inside your account'}
+                    continue
+                existing.add(data['title'])
+                data.pop('image', None)
+                instances.append((index, Post(user=request.user, slug=slugify(data['title']), **data)))
+            try:
+                with transaction.atomic():
+                    _ = Post.objects.bulk_create([instance for _, instance in instances], batch_size=500)
+            except IntegrityError:
+                context.update({'status': status.HTTP_400_BAD_REQUEST,
+                                'message': 'Some of these titles were added to your account while processing '
+                                           'the batch, Kindly try again'})
+                return Response(context, status=context['status'])
+            bump_cache_generation(POST_CACHE_PREFIX)
+            for index, instance in instances:
+                results[index] = {'index': index, 'status': status.HTTP_201_CREATED, 'id': instance.id}
+            context.update({'message': f'{len(instances)} of {len(results)} posts created', 'data': results})
+            if not instances:
+                context.update({'status': status.HTTP_400_BAD_REQUEST})
+        except Exception as ex:
+            context.update({'status': status.HTTP_400_BAD_REQUEST,
+                            'message': 'Something went wrong while creating posts,Kindly try again'})
+            self.logger().error(f'<{self.request.user}> error creating posts in bulk due to {format_exc(ex)}')
+        return Response(context, status=context['status'])
+
     @swagger_auto_schema(
         operation_description="Update a post",
         operation_summary="Update a post",
@@ -224,10 +394,13 @@ class PostViewSet(BaseViewSet):
                                 'message': 'You currently do not have access to this resource'})
                 return Response(context, status=context['status'])
             if serializer.is_valid():
-                instance = serializer.update(validated_data=serializer.validated_data, instance=instance)
-                context.update(
-                    {'data': self.serializer_class(instance).data, 'message': 'UPDATED',
-                     'status': status.HTTP_200_OK})
+                try:
+                    instance = serializer.update(validated_data=serializer.validated_data, instance=instance)
+                    context.update(
+                        {'data': self.cache_post(instance), 'message': 'UPDATED',
+                         'status': status.HTTP_200_OK})
+                except ValidationError as ex:
+                    context.update({'status': status.HTTP_400_BAD_REQUEST, 'message': ex.detail[0]})
             else:
                 context.update({
                     'errors': error_message_formatter(serializer.errors),
@@ -250,7 +423,8 @@ class PostViewSet(BaseViewSet):
                 context.update({'status': status.HTTP_403_FORBIDDEN,
                                 'message': 'You currently do not have access to this resource'})
                 return Response(context, status=context['status'])
-            instance.delete()
+            with deferred_comment_counters():
+                instance.delete()
         except Exception as ex:
             context.update({'message': str(ex), 'status': status.HTTP_400_BAD_REQUEST})
             self.logger().error(f'Something went wrong while deleting a blog post {kwargs} due to {format_exc(ex)}')
@@ -262,7 +436,10 @@ class PostCommentViewSet(BaseViewSet):
     serializer_class = CommentSerializer
     serializer_form_class = CommentFormSerializer
     filterset_fields = ['post__id']
+    export_fields = ['id', 'post_id', 'parent_comment_id', 'user_id', 'body', 'depth', 'timestamp']
+    export_name = 'comments'
     logger_name = 'core'
+    query_budgets = {'list': 1, 'thread': 1, 'export': 2, 'create': 7, 'update': 5, 'destroy': 7}
 
     def get_queryset(self):
         if self.request.GET.get('post__id') is None:
@@ -272,6 +449,9 @@ class PostCommentViewSet(BaseViewSet):
     def get_object(self):
         return get_object_or_404(self.queryset, id=self.kwargs.get('pk'))
 
+    def get_list_data(self):
+        return {'results': serialize(self.serializer_class(self.get_list(self.get_queryset()), many=True))}
+
     @swagger_auto_schema(
         operation_description="Display all available post comment",
         operation_summary="List all available post comment",
@@ -285,18 +465,106 @@ class PostCommentViewSet(BaseViewSet):
             )
         ],
     )
+    @method_decorator(etag_on_versions(get_comment_list_versions))
     def list(self, request, *args, **kwargs):
         context = {'status': status.HTTP_400_BAD_REQUEST}
         try:
-            context.update({"status": status.HTTP_200_OK, "message": "OK", "data": {
-                'results': self.serializer_class(self.get_list(self.get_queryset()), many=True).data
-            }})
+            context.update({"status": status.HTTP_200_OK, "message": "OK", "data": self.get_list_data()})
         except Exception as ex:
             context.update({'status': status.HTTP_400_BAD_REQUEST, 'message': str(ex)})
             self.logger().error(
                 f'Something went wrong while fetching post comment due to {format_exc(ex)}')
         return Response(context, status=context['status'])
 
+    @swagger_auto_schema(
+        operation_description="Stream post comments as NDJSON or CSV, every comment is exported when post__id "
+                              "is not supplied",
+        operation_summary="Export post comments",
+        manual_parameters=[
+            openapi.Parameter(
+                "export_format",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=False,
+                enum=["ndjson", "csv"],
+                description="Export format, defaults to ndjson",
+            ), openapi.Parameter(
+                "post__id",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description="Filter by post id",
+            )
+        ],
+    )
+    @action(detail=False, methods=["get"], description="Export post comments")
+    @method_decorator(global_permission(), name="dispatch")
+    def export(self, request, *args, **kwargs):
+        context = {'status': status.HTTP_400_BAD_REQUEST}
+        try:
+            return self.get_export_response(self.get_list(self.queryset))
+        except Exception as ex:
+            context.update({'message': str(ex)})
+            self.logger().error(f'Something went wrong while exporting post comment due to {str(ex)}')
+        return Response(context, status=context['status'])
+
+    @swagger_auto_schema(
+        operation_description="Display a post comments as a nested thread, or the subtree of a single comment",
+        operation_summary="Threaded post comments",
+        manual_parameters=[
+            openapi.Parameter(
+                "post__id",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description="Return the whole thread of this post",
+            ), openapi.Parameter(
+                "comment_id",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description="Return the subtree rooted at this comment",
+            ), openapi.Parameter(
+                "depth",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                required=False,
+                description="Maximum reply depth below the top level comments",
+            )
+        ],
+    )
+    @action(detail=False, methods=["get"], description="Threaded post comments")
+    def thread(self, request, *args, **kwargs):
+        context = {'status': status.HTTP_400_BAD_REQUEST}
+        try:
+            queryset = Comment.objects.all()
+            root_depth = 0
+            comment_id = request.GET.get('comment_id')
+            if comment_id:
+                # the root's post, path and depth are read by subqueries of the same statement, the subtree is
+                # a path range rather than a LIKE so comment_post_path_idx bounds the scan
+                root = Comment.objects.filter(id=comment_id)
+                root_path = Subquery(root.values('path')[:1])
+                queryset = queryset.filter(post_id=Subquery(root.values('post_id')[:1]), path__gte=root_path,
+                                           path__lt=Concat(root_path, Value(Comment.PATH_UPPER_BOUND)))
+                root_depth = Subquery(root.values('depth')[:1], output_field=IntegerField())
+            elif request.GET.get('post__id'):
+                queryset = queryset.filter(post_id=request.GET.get('post__id'))
+            else:
+                queryset = queryset.none()
+            if request.GET.get('depth'):
+                queryset = queryset.filter(depth__lte=root_depth + int(request.GET.get('depth')))
+            results = CommentThreadSerializer.build_tree(queryset.order_by('path'))
+            if comment_id and not results:
+                # a subtree always holds its root
+                raise Http404('No Comment matches the given query.')
+            context.update({"status": status.HTTP_200_OK, "message": "OK", "data": {'results': results}})
+        except Exception as ex:
+            context.update({'status': status.HTTP_400_BAD_REQUEST, 'message': str(ex)})
+            self.logger().error(
+                f'Something went wrong while fetching post comment thread due to {format_exc(ex)}')
+        return Response(context, status=context['status'])
+
     @swagger_auto_schema(
         operation_description="Add a post comment",
         operation_summary="Add a post comment",
@@ -363,7 +631,14 @@ class PostCommentViewSet(BaseViewSet):
                 context.update({'status': status.HTTP_403_FORBIDDEN,
                                 'message': 'You currently do not have access to this resource'})
                 return Response(context, status=context['status'])
-            instance.delete()
+            with deferred_comment_counters():
+                if instance.path:
+                    # the whole subtree is collected by its path prefix, the cascade then finds nothing left to
+                    # collect level by level
+                    _ = Comment.objects.filter(post_id=instance.post_id, path__startswith=instance.path).delete()
+                else:
+                    # an empty prefix would match the whole post, the cascade collects the subtree instead
+                    _ = instance.delete()
         except Exception as ex:
             context.update({'message': str(ex), 'status': status.HTTP_400_BAD_REQUEST})
             self.logger().error(f'Something went wrong while deleting a blog post {kwargs} due to {format_exc(ex)}')
@@ -0,0 +1,44 @@
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+# returned by next() once the streamed content is exhausted
+EXHAUSTED = object()
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGIHandler pulling streamed content off the event loop. Django 3.2 iterates a StreamingHttpResponse on the
+    loop itself, where exports reading a server-side cursor raise SynchronousOnlyOperation. Every part is read on
+    the thread sensitive executor instead, the thread the sync view ran on, so the cursor keeps its connection
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            response_headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': response_headers})
+        parts = iter(response)
+        read_part = sync_to_async(next, thread_sensitive=True)
+        while True:
+            part = await read_part(parts, EXHAUSTED)
+            if part is EXHAUSTED:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    """django.core.asgi.get_asgi_application serving streamed responses with StreamingASGIHandler"""
+    django.setup(set_prefix=False)
+    return StreamingASGIHandler()
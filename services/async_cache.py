@@ -0,0 +1,81 @@
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from redis import asyncio as aioredis
+
+from services.cache import get_cache_generation, get_generation_key
+
+logger = logging.getLogger('core')
+
+_redis = None
+_executor = None
+
+
+def get_async_redis():
+    """
+    Non-blocking client on the same redis as the django cache, values are encoded with the
+    django-redis client so both paths read each other's entries
+    """
+    global _redis
+    if _redis is None:
+        _redis = aioredis.Redis.from_url(settings.CACHES['default']['LOCATION'])
+    return _redis
+
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_ORM_WORKERS, thread_name_prefix='async-blocking')
+    return _executor
+
+
+def _run_blocking(func, *args, **kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs blocking ORM or cache work on the bounded pool so it never holds the event loop. The work runs in a
+    copy of the caller's context, it sees the request's ContextVars (database routing included) and what it
+    sets there does not outlive the call on the pooled thread
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_blocking_executor(),
+                                      partial(context.run, _run_blocking, func, *args, **kwargs))
+
+
+async def async_cache_get(key):
+    """A cache outage is treated as a miss"""
+    try:
+        value = await get_async_redis().get(cache.make_key(key))
+    except Exception as ex:
+        logger.error(f'Something went wrong while reading {key} from cache due to {str(ex)}')
+        return None
+    if value is None:
+        return None
+    return cache.client.decode(value)
+
+
+async def async_cache_set(key, value, timeout):
+    try:
+        await get_async_redis().set(cache.make_key(key), cache.client.encode(value), ex=timeout)
+    except Exception as ex:
+        logger.error(f'Something went wrong while writing {key} to cache due to {str(ex)}')
+
+
+async def async_get_cache_generation(key_prefix: str) -> int:
+    generation = await async_cache_get(get_generation_key(key_prefix))
+    if generation is None:
+        generation = await run_blocking(get_cache_generation, key_prefix)
+    return generation
@@ -1,21 +1,73 @@
+from django.core.cache import cache
 from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
 
 from core.models import User
+from services.cache import USER_CACHE_PREFIX, USER_CACHE_TIMEOUT, get_object_cache_key
+from services.metrics import record_cache_lookup
+from services.routers import PRIMARY_DATABASE
+
+
+def get_cached_user(user_id):
+    """
+    Returns the user with a short lived cache in front of the primary key lookup,
+    the entry is evicted whenever the user is saved or deleted. Misses read the primary,
+    a lagging replica would put the row that was just invalidated back into the cache
+    """
+    key = get_object_cache_key(USER_CACHE_PREFIX, user_id)
+    user = cache.get(key)
+    record_cache_lookup(f'{USER_CACHE_PREFIX}.detail', user is not None)
+    if user is None:
+        user = User.objects.using(PRIMARY_DATABASE).filter(pk=user_id).first()
+        if user is None:
+            return None
+        cache.set(key, user, timeout=USER_CACHE_TIMEOUT)
+    return user
 
 
 class CustomAuthBackend(object):
     def authenticate(self, request, username=None, password=None):
-        try:
-            users = User.objects.filter(Q(email=username) | Q(username=username))
-            for user in users:
-                if user.check_password(password):
-                    return user
+        """
+        Resolves the account with a single lookup on either the unique email or the unique username,
+        so a login costs one indexed read and one password hash
+        """
+        if username is None or password is None:
             return None
-        except User.DoesNotExist:
+        if '@' in username:
+            # the shape of the user_email_unique index, LOWER(email) on non blank emails
+            lookup = Q(email__lower=User.normalize_email_address(username)) & ~Q(email='')
+        else:
+            lookup = Q(username=username)
+        user = User.objects.filter(lookup).first()
+        if user is None:
+            # hash anyway so response time does not reveal whether the account exists
+            User().set_password(password)
             return None
+        if user.check_password(password):
+            return user
+        return None
 
     def get_user(self, user_id):
+        return get_cached_user(user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication resolving the token's user through the user cache"""
+
+    def get_user(self, validated_token):
         try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        return user
@@ -1,8 +1,13 @@
-from rest_framework.filters import OrderingFilter, SearchFilter
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.filters import BaseFilterBackend, OrderingFilter, SearchFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.viewsets import ViewSet
 
-from services.pagination import CustomPaginator
+from services.export import stream_export
+from services.pagination import CustomPaginator, CustomCursorPaginator
+from services.routers import pin_to_primary, user_is_pinned
 
 import logging
 
@@ -17,12 +22,32 @@ class CustomFilter(DjangoFilterBackend):
         return kwargs
 
 
+class FullTextSearchFilter(BaseFilterBackend):
+    """
+    Ranked postgres full-text search over the view's `search_vector_field`, matches are
+    resolved through the GIN index on the stored vector and ordered by relevance
+    """
+    search_param = "q"
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        vector_field = getattr(view, "search_vector_field", "search_vector")
+        query = SearchQuery(term, search_type="websearch", config=getattr(view, "search_config", "english"))
+        return queryset.filter(**{vector_field: query}).annotate(
+            rank=SearchRank(F(vector_field), query)
+        ).order_by("-rank", *queryset.query.order_by)
+
+
 class AbstractBaseViewSet:
     custom_filter_class = CustomFilter()
     search_backends = SearchFilter()
+    full_text_search_backend = FullTextSearchFilter()
     order_backend = OrderingFilter()
     filter_backends = [SearchFilter, DjangoFilterBackend]
     paginator_class = CustomPaginator()
+    cursor_paginator_class = CustomCursorPaginator()
 
     @staticmethod
     def get_data(request) -> dict:
@@ -32,13 +57,30 @@ class AbstractBaseViewSet:
 
 class BaseViewSet(ViewSet, AbstractBaseViewSet):
     logger_name = '__file__'
+    export_fields = []
+    export_name = 'export'
+    # most SQL statements an action may run whatever the data size, enforced by the query_budget test fixture
+    query_budgets = {}
 
     def logger(self):
         return logging.getLogger(self.logger_name)
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # writes validate against the primary, and a user who just wrote keeps reading their own writes from it
+        if request.method not in SAFE_METHODS or (request.user.is_authenticated and user_is_pinned(request.user.id)):
+            pin_to_primary()
+
     def get_list(self, queryset):
         query_set = queryset
-        if "search" in self.request.query_params:
+        if self.full_text_search_backend.search_param in self.request.query_params:
+            query_set = self.full_text_search_backend.filter_queryset(
+                request=self.request, queryset=queryset, view=self
+            )
+            query_set = self.custom_filter_class.filter_queryset(
+                request=self.request, queryset=query_set, view=self
+            )
+        elif "search" in self.request.query_params:
             query_set = self.search_backends.filter_queryset(
                 request=self.request, queryset=queryset, view=self
             )
@@ -47,7 +89,7 @@ class BaseViewSet(ViewSet, AbstractBaseViewSet):
                 request=self.request, queryset=queryset, view=self
             )
         if "ordering" in self.request.query_params:
-            query_set = self.order_backend.filter_queryset(request=self.request, queryset=queryset, view=self)
+            query_set = self.order_backend.filter_queryset(request=self.request, queryset=query_set, view=self)
         return query_set
 
     def get_paginated_data(self, queryset, serializer_class):
@@ -55,3 +97,13 @@ class BaseViewSet(ViewSet, AbstractBaseViewSet):
             queryset, serializer_class, self.request
         )
         return paginated_data
+
+    def get_cursor_paginated_data(self, queryset, serializer_class):
+        return self.cursor_paginator_class.generate_response(
+            queryset, serializer_class, self.request
+        )
+
+    def get_export_response(self, queryset):
+        """Streams the queryset as ndjson (default) or csv, picked with the `export_format` query param"""
+        return stream_export(queryset, self.export_fields, self.request.GET.get('export_format', 'ndjson'),
+                             filename=self.export_name)
@@ -0,0 +1,224 @@
+import hashlib
+import math
+import random
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import (
+    get_cache_key, get_conditional_response, has_vary_header, learn_cache_key, patch_response_headers,
+)
+
+from services.compression import compressed, negotiate_request_encoding
+from services.metrics import record_cache_lookup
+from services.routers import is_pinned_to_primary, primary_reads
+
+POST_CACHE_PREFIX = 'post'
+POST_DETAIL_CACHE_TIMEOUT = 60 * 60
+USER_CACHE_PREFIX = 'user'
+COMMENT_CACHE_PREFIX = 'comment'
+USER_CACHE_TIMEOUT = 60 * 5
+PAGE_CACHE_POLL_INTERVAL = 0.05
+
+
+def get_generation_key(key_prefix: str) -> str:
+    return f'{key_prefix}.generation'
+
+
+def get_cache_generation(key_prefix: str) -> int:
+    """Returns the current generation of a cache namespace"""
+    return cache.get_or_set(get_generation_key(key_prefix), 1, timeout=None)
+
+
+def bump_cache_generation(key_prefix: str) -> int:
+    """
+    Invalidates every entry cached under key_prefix in O(1) by moving the namespace to a new generation,
+    entries of the previous generation are never read again and expire on their own timeout
+    """
+    key = get_generation_key(key_prefix)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+        return cache.incr(key)
+
+
+def get_object_cache_key(key_prefix: str, pk) -> str:
+    return f'{key_prefix}.detail.{pk}'
+
+
+def get_version_key(key_prefix: str, pk=None) -> str:
+    return f'{key_prefix}.version' if pk is None else f'{key_prefix}.version.{pk}'
+
+
+def get_versions(*keys) -> list:
+    """
+    Current value of every version key in one round trip. A version is invalidated by deleting it, it then
+    restarts at the current time, so a deleted or evicted version never comes back with a value seen before
+    """
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            values[key] = cache.get_or_set(key, time.time_ns, timeout=None)
+    return [values[key] for key in keys]
+
+
+def invalidate_versions(*keys):
+    cache.delete_many(keys)
+
+
+def get_versioned(key, version_key):
+    """
+    The value stored by set_versioned under key, None unless it was stored under the current version, along
+    with that version. Read the version before reading what gets stored: a write invalidating the version in
+    between leaves an entry that is never served
+    """
+    values = cache.get_many([key, version_key])
+    version = values[version_key] if version_key in values else get_versions(version_key)[0]
+    entry = values.get(key)
+    return (entry['value'] if entry is not None and entry['version'] == version else None), version
+
+
+def set_versioned(key, value, version, timeout):
+    cache.set(key, {'value': value, 'version': version}, timeout=timeout)
+
+
+def get_page_lock_key(key_prefix: str, url: str) -> str:
+    return f'{key_prefix}.page.lock.{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def acquire_lock(key: str, timeout: int):
+    """Returns the token owning the lock, None when it is already held"""
+    token = uuid.uuid4().hex
+    return token if cache.add(key, token, timeout=timeout) else None
+
+
+def release_lock(key: str, token: str):
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def should_refresh_early(entry: dict, beta: float) -> bool:
+    """
+    Probabilistic early expiration (XFetch), a request rebuilds a still fresh page with a probability growing
+    as the page nears its expiry and with how long it took to build, so one request usually refreshes a hot
+    page before it expires instead of all of them at once after
+    """
+    if beta <= 0:
+        return False
+    return time.time() - entry['delta'] * beta * math.log(1.0 - random.random()) >= entry['expires_at']
+
+
+def is_cacheable(request, response) -> bool:
+    """The same responses django's cache middleware would store"""
+    if response.streaming or response.status_code != 200 or 'private' in response.get('Cache-Control', ()):
+        return False
+    return bool(request.COOKIES or not response.cookies or not has_vary_header(response, 'Cookie'))
+
+
+def wait_for_page(request, key_prefix, generation):
+    """Polls for the page another request is building, None if it is not there within PAGE_CACHE_LOCK_WAIT"""
+    deadline = time.monotonic() + settings.PAGE_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(PAGE_CACHE_POLL_INTERVAL)
+        cache_key = get_cache_key(request, key_prefix, 'GET', cache=cache)
+        entry = cache.get(cache_key) if cache_key else None
+        if entry is not None and entry['generation'] == generation:
+            return entry
+    return None
+
+
+def set_page_etag(response):
+    """Weak ETag hashed from the rendered page, so it changes exactly when the page a client gets does"""
+    if response.status_code == 200 and not response.streaming:
+        response['ETag'] = f'W/"{hashlib.md5(response.content).hexdigest()}"'
+    return response
+
+
+def serve_page(request, entry):
+    """The stored page, or a 304 carrying its headers when If-None-Match already holds its ETag"""
+    response = entry['response']
+    return get_conditional_response(request, etag=response.get('ETag'), response=response) or response
+
+
+def versioned_cache_page(timeout, key_prefix):
+    """
+    Page cache like django's cache_page, invalidated with bump_cache_generation and protected from stampedes.
+
+    Every page is stored with the generation it was built under and outlives its timeout by
+    PAGE_CACHE_STALE_TTL. When it expired or its generation is outdated a single request, holding a short
+    lock, rebuilds it while concurrent requests are served the previous page. Requests finding nothing to
+    serve wait up to PAGE_CACHE_LOCK_WAIT for that rebuild, and fresh pages are rebuilt early with a small
+    probability (should_refresh_early) so a hot page rarely expires at all. Pages are compressed with the
+    coding negotiated from Accept-Encoding before they are cached, so a hit is served as stored.
+
+    Pages carry an ETag hashed from their content (set_page_etag), stored along with them. A conditional
+    request whose If-None-Match holds the ETag of the page it would be served gets a 304 from that entry
+    """
+
+    def decorator(view_func):
+        compressed_view = compressed(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if is_pinned_to_primary() or request.method != 'GET':
+                # the shared page may have been rendered from a replica that has not seen this user's write
+                return compressed_view(request, *args, **kwargs)
+            # before the lookup, the cache key varies on the negotiated coding rather than the client's header
+            negotiate_request_encoding(request)
+            generation = get_cache_generation(key_prefix)
+            cache_key = get_cache_key(request, key_prefix, 'GET', cache=cache)
+            entry = cache.get(cache_key) if cache_key else None
+            if entry is not None and entry['generation'] == generation and entry['expires_at'] > time.time() and \
+                    not should_refresh_early(entry, settings.PAGE_CACHE_EARLY_REFRESH_BETA):
+                record_cache_lookup(key_prefix, True)
+                return serve_page(request, entry)
+            lock_key = get_page_lock_key(key_prefix, request.build_absolute_uri())
+            token = acquire_lock(lock_key, settings.PAGE_CACHE_LOCK_TIMEOUT)
+            if token is None:
+                # another request is rebuilding the page, serve what is there rather than query again
+                entry = entry if entry is not None else wait_for_page(request, key_prefix, generation)
+                if entry is not None:
+                    record_cache_lookup(key_prefix, True)
+                    return serve_page(request, entry)
+            record_cache_lookup(key_prefix, False)
+            started = time.perf_counter()
+            try:
+                with primary_reads():
+                    response = compressed_view(request, *args, **kwargs)
+            except Exception:
+                if token is not None:
+                    release_lock(lock_key, token)
+                raise
+            if not is_cacheable(request, response):
+                if token is not None:
+                    release_lock(lock_key, token)
+                return response
+            patch_response_headers(response, timeout)
+            stored_key = learn_cache_key(request, response, timeout + settings.PAGE_CACHE_STALE_TTL, key_prefix,
+                                         cache=cache)
+
+            def store(rendered):
+                try:
+                    set_page_etag(rendered)
+                    cache.set(stored_key, {
+                        'response': rendered,
+                        'generation': generation,
+                        'expires_at': time.time() + timeout,
+                        'delta': time.perf_counter() - started,
+                    }, timeout + settings.PAGE_CACHE_STALE_TTL)
+                finally:
+                    if token is not None:
+                        release_lock(lock_key, token)
+
+            if hasattr(response, 'render') and callable(response.render) and not response.is_rendered:
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+
+        return wrapper
+
+    return decorator
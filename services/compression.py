@@ -0,0 +1,91 @@
+import gzip
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+IDENTITY = 'identity'
+
+
+def get_supported_encodings() -> tuple:
+    """Codings the server can produce, most preferred first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """
+    Picks the preferred coding the client accepts from an Accept-Encoding header, identity when none.
+    Codings with q=0 are refused, `*` stands for every coding not listed explicitly
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    candidates = [
+        (accepted.get(coding, accepted.get('*', 0.0)), -index, coding)
+        for index, coding in enumerate(get_supported_encodings())
+    ]
+    quality, _, coding = max(candidates)
+    return coding if quality > 0 else IDENTITY
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(content, quality=settings.RESPONSE_BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical for identical content
+        return gzip.compress(content, compresslevel=settings.RESPONSE_GZIP_LEVEL, mtime=0)
+    return content
+
+
+def compress_response(response, encoding: str):
+    """Compresses a rendered response in place unless it is streamed, already encoded or too small to bother"""
+    if encoding == IDENTITY or response.streaming or response.has_header('Content-Encoding') or \
+            len(response.content) < settings.RESPONSE_COMPRESSION_MIN_LENGTH:
+        return response
+    response.content = compress(response.content, encoding)
+    response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(len(response.content))
+    return response
+
+
+def negotiate_request_encoding(request) -> str:
+    """
+    Negotiates the coding of the response and narrows the request's Accept-Encoding down to it, so a page
+    cache varying on Accept-Encoding keeps one entry per coding instead of one per distinct client header
+    """
+    encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    request.META['HTTP_ACCEPT_ENCODING'] = encoding
+    return encoding
+
+
+def compressed(view_func):
+    """Compresses the view's response with the coding negotiated from Accept-Encoding, once it is rendered"""
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        encoding = negotiate_request_encoding(request)
+        response = view_func(request, *args, **kwargs)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if hasattr(response, 'render') and callable(response.render) and not response.is_rendered:
+            response.add_post_render_callback(lambda rendered: compress_response(rendered, encoding))
+        else:
+            compress_response(response, encoding)
+        return response
+
+    return wrapper
@@ -0,0 +1,42 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+
+from services.cache import get_versions
+
+
+def build_etag(versions, path) -> str:
+    digest = hashlib.md5(f'{":".join(map(str, versions))}:{path}'.encode()).hexdigest()
+    # weak, the same page is sent with different content codings
+    return f'W/"{digest}"'
+
+
+def etag_on_versions(get_version_keys):
+    """
+    Conditional GET for views whose payload only changes when one of the versions named by
+    get_version_keys(request, *args, **kwargs) is invalidated. The ETag is derived from the versions alone,
+    so a matching If-None-Match is answered with a 304 after a single cache read, before the page cache
+    is looked up or anything is serialized. Successful responses carry the ETag computed before the view ran.
+    Views behind versioned_cache_page do not need it, the page cache answers with the ETag of the stored page
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            keys = get_version_keys(request, *args, **kwargs) if request.method in ('GET', 'HEAD') else None
+            if not keys:
+                return view_func(request, *args, **kwargs)
+            etag = build_etag(get_versions(*keys), request.get_full_path())
+            conditional_response = get_conditional_response(request, etag=etag)
+            if conditional_response is not None:
+                conditional_response['ETag'] = etag
+                return conditional_response
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == 200:
+                response.setdefault('ETag', etag)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,63 @@
+import csv
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+DEFAULT_EXPORT_CHUNK_SIZE = 2000
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo(object):
+    """File-like object handing every written csv line straight back to the caller"""
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+def iter_rows(queryset, fields, chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+    """
+    Streams only the exported columns through a server-side cursor, so memory stays bound by chunk_size
+    however many rows match
+    """
+    return queryset.values(*fields).iterator(chunk_size=chunk_size)
+
+
+def iter_ndjson(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def iter_csv(rows, fields):
+    encoder = DjangoJSONEncoder()
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([
+            encoder.default(row[field]) if isinstance(row[field], (date, datetime, Decimal, UUID)) else row[field]
+            for field in fields
+        ])
+
+
+def iter_export(queryset, fields, export_format, chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+    if export_format not in EXPORT_CONTENT_TYPES:
+        raise ValueError(f'Unsupported export format ({export_format}), use one of '
+                         f'{", ".join(EXPORT_CONTENT_TYPES)}')
+    rows = iter_rows(queryset, fields, chunk_size=chunk_size)
+    if export_format == 'csv':
+        return iter_csv(rows, fields)
+    return iter_ndjson(rows)
+
+
+def stream_export(queryset, fields, export_format, filename, chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+    response = StreamingHttpResponse(iter_export(queryset, fields, export_format, chunk_size=chunk_size),
+                                     content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -0,0 +1,103 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from services.log import format_exc
+from services.routers import pin_to_primary
+
+logger = logging.getLogger('core')
+
+IMAGE_VARIANTS = {
+    'thumbnail': {'size': (320, 320), 'format': 'JPEG', 'extension': 'jpg', 'quality': 80},
+    'medium': {'size': (1024, 1024), 'format': 'JPEG', 'extension': 'jpg', 'quality': 82},
+    'webp': {'size': (1024, 1024), 'format': 'WEBP', 'extension': 'webp', 'quality': 80},
+}
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS,
+                                       thread_name_prefix='image-variants')
+    return _executor
+
+
+def variants_are_stale(field_file, variants) -> bool:
+    """Variants are keyed by the source file they were rendered from"""
+    if not field_file:
+        return bool(variants)
+    return (variants or {}).get('source') != field_file.name
+
+
+def render_variant(image, spec) -> bytes:
+    variant = image.copy()
+    variant.thumbnail(spec['size'], Image.LANCZOS)
+    if spec['format'] == 'JPEG' and variant.mode != 'RGB':
+        variant = variant.convert('RGB')
+    buffer = BytesIO()
+    variant.save(buffer, format=spec['format'], quality=spec['quality'], optimize=True,
+                 **({'progressive': True} if spec['format'] == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+def generate_image_variants(model, pk, field_name, variants_field, on_complete=None):
+    """
+    Renders every IMAGE_VARIANTS entry of the image stored on model(pk).field_name and records their
+    storage paths on variants_field, the row is written with a queryset update so no save signal fires
+    """
+    instance = model.objects.filter(pk=pk).only(field_name, variants_field).first()
+    if instance is None:
+        return None
+    field_file = getattr(instance, field_name)
+    if not variants_are_stale(field_file, getattr(instance, variants_field)):
+        return getattr(instance, variants_field)
+    variants = {}
+    if field_file:
+        stem = os.path.splitext(os.path.basename(field_file.name))[0]
+        directory = os.path.join(os.path.dirname(field_file.name), 'variants')
+        with field_file.open('rb') as source, Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            for name, spec in IMAGE_VARIANTS.items():
+                path = os.path.join(directory, f'{stem}_{name}.{spec["extension"]}')
+                variants[name] = default_storage.save(path, ContentFile(render_variant(image, spec)))
+        variants['source'] = field_file.name
+    # the upload may have been replaced while rendering, only record variants of the current image
+    _ = model.objects.filter(pk=pk, **{field_name: field_file.name}).update(**{variants_field: variants})
+    if on_complete is not None:
+        on_complete(instance)
+    return variants
+
+
+def run_image_variants_task(*args, **kwargs):
+    # scheduled right after the commit, a replica may not have the row yet
+    pin_to_primary()
+    try:
+        generate_image_variants(*args, **kwargs)
+    except Exception as ex:
+        logger.error(f'Something went wrong while generating image variants due to {format_exc(ex)}')
+    finally:
+        # worker threads own their connection, release it instead of leaking one per thread
+        connection.close()
+
+
+def schedule_image_variants(model, pk, field_name, variants_field, on_complete=None):
+    """Renders the variants on the worker pool once the current transaction commits"""
+    transaction.on_commit(lambda: get_executor().submit(
+        run_image_variants_task, model, pk, field_name, variants_field, on_complete
+    ))
+
+
+def get_variant_urls(variants) -> dict:
+    return {
+        name: f'{settings.BASE_URL}{default_storage.url(path)}'
+        for name, path in (variants or {}).items() if name != 'source'
+    }
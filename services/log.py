@@ -0,0 +1,125 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from django.conf import settings
+from traceback_with_variables import Format, format_exc as format_exc_with_variables
+
+from services.metrics import LOG_RECORDS_DROPPED
+
+# LogRecord attributes that are not `extra` values passed by the caller
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class TracebackRateLimiter(object):
+    """Allows `limit` full tracebacks per `window` seconds, per process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.count = 0
+
+    def acquire(self, limit, window) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= window:
+                self.window_start, self.count = now, 0
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+
+_limiter = TracebackRateLimiter()
+
+
+def format_exc(ex) -> str:
+    """
+    Traceback with the local variables of every frame while under LOG_TRACEBACK_VARIABLES_LIMIT per
+    LOG_TRACEBACK_VARIABLES_WINDOW seconds, the plain traceback beyond that. Dumping the variables is the
+    slow part, this keeps an error storm from spending its time rendering locals of identical failures
+    """
+    if _limiter.acquire(settings.LOG_TRACEBACK_VARIABLES_LIMIT, settings.LOG_TRACEBACK_VARIABLES_WINDOW):
+        return format_exc_with_variables(ex, fmt=Format(max_value_str_len=settings.LOG_TRACEBACK_MAX_VALUE_LENGTH))
+    return ''.join(traceback.format_exception(type(ex), ex, ex.__traceback__)) + \
+        '(variables omitted, traceback rate limit reached)'
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, `extra` values passed by the caller are kept as fields"""
+
+    def format(self, record) -> str:
+        document = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'lineno': record.lineno,
+            'process': record.process,
+            'thread': record.thread,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            document['exception'] = record.exc_text
+        document.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        return json.dumps(document, default=str)
+
+
+class JsonFileListener(QueueListener):
+    """QueueListener that can be stopped more than once and waits for room for its sentinel"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class QueuedJsonFileHandler(QueueHandler):
+    """
+    Puts records on a bounded in-memory queue and returns, a background listener writes them to a
+    rotating file as JSON lines. When the writer falls behind the queue fills up and new records
+    are dropped instead of blocking the request thread, counted by the log_records_dropped metric
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.dropped = 0
+        file_handler = RotatingFileHandler(filename, maxBytes=maxBytes, backupCount=backupCount)
+        file_handler.setFormatter(JsonFormatter())
+        self.listener = JsonFileListener(self.queue, file_handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def prepare(self, record):
+        # the message is rendered here since args may be mutated once the caller moves on, the exception
+        # is rendered to text so the record does not keep the frames (and their locals) alive in the queue
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def close(self):
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        super().close()
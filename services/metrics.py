@@ -0,0 +1,122 @@
+import os
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, \
+    generate_latest, multiprocess
+
+from services.middleware import HybridMiddleware
+
+# with PROMETHEUS_MULTIPROC_DIR set (required when running several workers) every process writes its samples
+# to that directory and /metrics aggregates them, otherwise each worker would only report its own requests
+MULTIPROCESS_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency per view and action',
+                            ['view', 'action', 'method'])
+REQUESTS = Counter('http_requests', 'Requests per view, action and status code',
+                   ['view', 'action', 'method', 'status'])
+DB_QUERIES = Histogram('db_queries_per_request', 'SQL queries executed per request', ['view', 'action'],
+                       buckets=QUERY_COUNT_BUCKETS)
+DB_QUERY_DURATION = Histogram('db_query_duration_seconds', 'Time spent in SQL per request', ['view', 'action'])
+CACHE_REQUESTS = Counter('cache_requests', 'Cache lookups per key prefix and result', ['prefix', 'result'])
+SERIALIZER_DURATION = Histogram('serializer_duration_seconds', 'Time spent rendering serializer data',
+                                ['serializer'])
+LOG_RECORDS_DROPPED = Counter('log_records_dropped', 'Log records dropped because the log queue was full')
+
+
+class QueryTimer(object):
+    """execute_wrapper counting the queries run while it is installed and the time spent on them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+@contextmanager
+def track_queries():
+    """Times every query of the current thread, on every database alias"""
+    timer = QueryTimer()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        yield timer
+
+
+def get_view_labels(request) -> tuple:
+    """ViewSet class and action of the resolved view, which keeps the label set bound by the url conf"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', ''
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.func.__name__, ''
+    actions = getattr(match.func, 'actions', None) or {}
+    return view_class.__name__, actions.get(request.method.lower(), request.method.lower())
+
+
+def record_cache_lookup(prefix: str, hit: bool):
+    CACHE_REQUESTS.labels(prefix, 'hit' if hit else 'miss').inc()
+
+
+def serialize(serializer):
+    """Returns serializer.data, timing the rendering under the serializer's name"""
+    name = type(getattr(serializer, 'child', serializer)).__name__
+    with SERIALIZER_DURATION.labels(name).time():
+        return serializer.data
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Observes latency, SQL query count and SQL time of every request. The queries of async views run on
+    executor threads this middleware cannot wrap, their requests only observe latency and status
+    """
+
+    def process(self, request):
+        start = time.perf_counter()
+        with track_queries() as timer:
+            response = self.get_response(request)
+        view, action = self.observe(request, response, time.perf_counter() - start)
+        DB_QUERIES.labels(view, action).observe(timer.count)
+        DB_QUERY_DURATION.labels(view, action).observe(timer.duration)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def observe(request, response, duration) -> tuple:
+        view, action = get_view_labels(request)
+        REQUEST_LATENCY.labels(view, action, request.method).observe(duration)
+        REQUESTS.labels(view, action, request.method, str(response.status_code)).inc()
+        return view, action
+
+
+def get_registry():
+    if os.environ.get(MULTIPROCESS_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_view(request):
+    """Prometheus text exposition, restricted to `Authorization: Bearer <METRICS_TOKEN>` when a token is set"""
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,56 @@
+import asyncio
+
+from services.routers import has_written, pin_user_to_primary, reset_routing_state
+
+
+class HybridMiddleware(object):
+    """
+    Base of middleware running natively under both WSGI and ASGI. Under ASGI Django hands async capable
+    middleware an async get_response, __call__ then returns the coroutine of __acall__ instead of Django
+    adapting the whole chain to sync, which would hold a thread for every async view
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # lets Django see the instance as a coroutine function, as its own MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process(request)
+
+    def process(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+
+class ReadYourWritesMiddleware(HybridMiddleware):
+    """
+    Starts every request on a clean routing state and, when the request wrote to the primary,
+    pins its user to the primary for READ_YOUR_WRITES_WINDOW seconds. request.user is read after
+    the view ran, so it is the user DRF authenticated (JWT included)
+    """
+
+    def process(self, request):
+        reset_routing_state()
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if has_written() and user is not None and user.is_authenticated:
+            pin_user_to_primary(user.id)
+        reset_routing_state()
+        return response
+
+    async def __acall__(self, request):
+        # the async views only read, the routing state is reset for what runs after them on this context
+        reset_routing_state()
+        response = await self.get_response(request)
+        reset_routing_state()
+        return response
+
@@ -1,8 +1,16 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
 
+from services.metrics import serialize
+
 DEFAULT_PAGE = 1
 DEFAULT_PAGE_SIZE = 3
+MAX_CURSOR_PAGE_SIZE = 100
 
 
 class CustomPaginator(PageNumberPagination):
@@ -27,6 +35,68 @@ class CustomPaginator(PageNumberPagination):
             "total_pages": self.page.paginator.num_pages,
             "page": int(request.GET.get("page", DEFAULT_PAGE)),
             "limit": int(request.GET.get("limit", self.page_size)),
-            "results": serialized_page.data,
+            "results": serialize(serialized_page),
+        }
+        return response
+
+
+class CustomCursorPaginator(object):
+    """
+    Keyset paginator walking a queryset on (-created_at, -id).
+    The cursor is an opaque token holding the last row's created_at and id, so every page
+    is a single indexed range scan with no COUNT(*) or OFFSET regardless of how deep it is.
+    """
+    page_size = DEFAULT_PAGE_SIZE
+    max_page_size = MAX_CURSOR_PAGE_SIZE
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    ordering = ("-created_at", "-id")
+
+    @staticmethod
+    def encode_cursor(instance) -> str:
+        # pages fetched with .values() hold dicts instead of model instances
+        created_at, pk = (instance["created_at"], instance["id"]) if isinstance(instance, dict) else \
+            (instance.created_at, instance.id)
+        payload = json.dumps({"c": created_at.isoformat(), "i": pk}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(token: str):
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return datetime.fromisoformat(payload["c"]), int(payload["i"])
+
+    def get_page_size(self, request) -> int:
+        try:
+            limit = int(request.GET.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if limit < 1:
+            return self.page_size
+        return min(limit, self.max_page_size)
+
+    def generate_response(self, query_set, serializer_obj, request):
+        limit = self.get_page_size(request)
+        token = request.GET.get(self.cursor_query_param)
+        query_set = query_set.order_by(*self.ordering)
+        if token:
+            try:
+                created_at, pk = self.decode_cursor(token)
+            except Exception:
+                return {
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "message": "Invalid cursor supplied",
+                }
+            query_set = query_set.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        rows = list(query_set[:limit + 1])
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        serialized_page = serializer_obj(rows, many=True, context={"request": request})
+        response = {
+            "status": status.HTTP_200_OK,
+            "message": "ok",
+            "limit": limit,
+            "next": self.encode_cursor(rows[-1]) if has_next else None,
+            "results": serialize(serialized_page),
         }
         return response
@@ -0,0 +1,193 @@
+import atexit
+import cProfile
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from silk.models import Request, Response
+
+from services.log import format_exc
+from services.metrics import track_queries
+from services.middleware import HybridMiddleware
+
+logger = logging.getLogger('core')
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+def get_sample_rate(request) -> float:
+    """Per endpoint rate from PROFILING_SAMPLE_RATES keyed by url name, PROFILING_DEFAULT_SAMPLE_RATE otherwise"""
+    try:
+        url_name = resolve(request.path_info).url_name
+    except Resolver404:
+        return 0.0
+    return settings.PROFILING_SAMPLE_RATES.get(url_name, settings.PROFILING_DEFAULT_SAMPLE_RATE)
+
+
+def should_profile(request) -> bool:
+    if not settings.PROFILING_ENABLED:
+        return False
+    token = settings.PROFILING_HEADER_TOKEN
+    if token and request.META.get(PROFILE_HEADER) == token:
+        return True
+    rate = get_sample_rate(request)
+    return rate > 0 and random.random() < rate
+
+
+class SampleBuffer(object):
+    """
+    Keeps finished samples in memory for a daemon thread, which writes them to silk's tables in one batch once
+    PROFILING_FLUSH_SIZE samples are waiting or every PROFILING_FLUSH_INTERVAL seconds. Requests only append,
+    none of them pays for the write
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=settings.PROFILING_BUFFER_SIZE)
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping = False
+                self.thread = threading.Thread(target=self.run, name='profiling-flush', daemon=True)
+                self.thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the flushing thread once it has written what is waiting"""
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.wait(settings.PROFILING_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def add(self, sample):
+        with self.lock:
+            self.samples.append(sample)
+            due = len(self.samples) >= settings.PROFILING_FLUSH_SIZE
+        if due:
+            self.wakeup.set()
+
+    def drain(self) -> list:
+        with self.lock:
+            samples = list(self.samples)
+            self.samples.clear()
+        return samples
+
+    def flush(self) -> int:
+        samples = self.drain()
+        if not samples:
+            return 0
+        try:
+            write_samples(samples)
+        except Exception as ex:
+            logger.error(f'Something went wrong while writing {len(samples)} profiling samples due to '
+                         f'{format_exc(ex)}')
+            return 0
+        return len(samples)
+
+
+def write_samples(samples):
+    requests = Request.objects.bulk_create([Request(
+        path=sample['path'][:190],
+        query_params=sample['query_params'],
+        method=sample['method'],
+        view_name=(sample['view_name'] or '')[:190],
+        start_time=sample['start_time'],
+        end_time=sample['start_time'] + timedelta(milliseconds=sample['time_taken']),
+        time_taken=sample['time_taken'],
+        num_sql_queries=sample['num_sql_queries'],
+        pyprofile=sample['pyprofile'],
+    ) for sample in samples])
+    Response.objects.bulk_create([
+        Response(request=request, status_code=sample['status_code']) for request, sample in zip(requests, samples)
+    ])
+    Request.garbage_collect(force=False)
+
+
+_buffer = None
+
+
+def get_sample_buffer() -> SampleBuffer:
+    global _buffer
+    if _buffer is None:
+        _buffer = SampleBuffer()
+        _buffer.start()
+        atexit.register(_buffer.stop)
+    return _buffer
+
+
+def format_profile(profile) -> str:
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(settings.PROFILING_TOP_FUNCTIONS)
+    return stream.getvalue()
+
+
+class SampledProfilerMiddleware(HybridMiddleware):
+    """
+    Profiles a sample of the requests instead of every one of them, a request is profiled when it carries
+    the PROFILING_HEADER_TOKEN in the X-Profile header or wins its endpoint's sampling rate. Requests that
+    are not sampled only pay for the PROFILING_ENABLED check. Async requests interleave on the event loop,
+    their samples keep the timings without a cProfile dump or query count
+    """
+
+    def process(self, request):
+        if not should_profile(request):
+            return self.get_response(request)
+        profile = cProfile.Profile()
+        start_time, start = timezone.now(), time.perf_counter()
+        with track_queries() as timer:
+            try:
+                profile.enable()
+            except ValueError:
+                # another profiler is already running on this interpreter, keep the timings only
+                profile = None
+            try:
+                response = self.get_response(request)
+            finally:
+                if profile is not None:
+                    profile.disable()
+        self.add_sample(request, response, start_time, start, timer.count,
+                        format_profile(profile) if profile is not None else '')
+        return response
+
+    async def __acall__(self, request):
+        if not should_profile(request):
+            return await self.get_response(request)
+        start_time, start = timezone.now(), time.perf_counter()
+        response = await self.get_response(request)
+        self.add_sample(request, response, start_time, start, 0, '')
+        return response
+
+    @staticmethod
+    def add_sample(request, response, start_time, start, num_sql_queries, pyprofile):
+        get_sample_buffer().add({
+            'path': request.path,
+            'query_params': request.META.get('QUERY_STRING', ''),
+            'method': request.method,
+            'view_name': getattr(request.resolver_match, 'view_name', ''),
+            'status_code': response.status_code,
+            'start_time': start_time,
+            'time_taken': (time.perf_counter() - start) * 1000,
+            'num_sql_queries': num_sql_queries,
+            'pyprofile': pyprofile,
+        })
@@ -0,0 +1,47 @@
+import codecs
+
+import orjson
+from django.conf import settings
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.utils.encoders import JSONEncoder
+
+# datetimes, dates, times and UUIDs are encoded natively, in the same format as DRF's encoder
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+# everything orjson has no native encoding for (Decimal, lazy strings, querysets...) goes through DRF's encoder
+default = JSONEncoder().default
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer producing the same bytes through orjson for the default compact, unicode output.
+    Indented output (`Accept: application/json; indent=4`) and non default JSON settings fall back to DRF
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None or \
+                not (self.compact and self.ensure_ascii is False and self.strict):
+            return super().render(data, accepted_media_type, renderer_context)
+        content = orjson.dumps(data, default=default, option=ORJSON_OPTIONS)
+        # like DRF, keep the output valid javascript, which does not allow these two raw
+        if b'\xe2\x80\xa8' in content or b'\xe2\x80\xa9' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return content
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            content = stream.read()
+            if codecs.lookup(encoding).name != 'utf-8':
+                content = content.decode(encoding)
+            return orjson.loads(content)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,95 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+PRIMARY_DATABASE = 'default'
+PIN_CACHE_PREFIX = 'db.pinned'
+# only the application models are replicated reads, silk, sessions and friends always use the primary
+ROUTED_APP_LABELS = {'core'}
+
+_pinned = ContextVar('pinned_to_primary', default=False)
+_wrote = ContextVar('wrote_to_primary', default=False)
+
+
+def get_replica_databases() -> list:
+    return list(settings.REPLICA_DATABASES)
+
+
+def reset_routing_state():
+    _pinned.set(False)
+    _wrote.set(False)
+
+
+def pin_to_primary():
+    """Every following read of the current request (or thread) is served by the primary"""
+    _pinned.set(True)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Reads inside the block are served by the primary, for caches shared by every reader: filled from a
+    replica that has not replayed a write yet, they would serve the stale rows for their whole timeout
+    """
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        if not has_written():
+            _pinned.reset(token)
+
+
+def is_pinned_to_primary() -> bool:
+    return _pinned.get()
+
+
+def has_written() -> bool:
+    return _wrote.get()
+
+
+def get_pin_cache_key(user_id) -> str:
+    return f'{PIN_CACHE_PREFIX}.{user_id}'
+
+
+def pin_user_to_primary(user_id):
+    """Keeps the user reading from the primary until the replicas have caught up with their write"""
+    cache.set(get_pin_cache_key(user_id), 1, timeout=settings.READ_YOUR_WRITES_WINDOW)
+
+
+def user_is_pinned(user_id) -> bool:
+    return cache.get(get_pin_cache_key(user_id)) is not None
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads of the application models to a random replica and every write to the primary.
+    Once something is written the rest of the request reads from the primary, so it never sees
+    a replica that has not replayed the write yet
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in ROUTED_APP_LABELS:
+            return None
+        replicas = get_replica_databases()
+        if not replicas or is_pinned_to_primary():
+            return PRIMARY_DATABASE
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in ROUTED_APP_LABELS:
+            _wrote.set(True)
+            pin_to_primary()
+        return PRIMARY_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY_DATABASE, *get_replica_databases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas receive the schema through replication
+        return db == PRIMARY_DATABASE
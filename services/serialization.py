@@ -0,0 +1,82 @@
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+
+FIELD, METHOD, NESTED = range(3)
+
+
+def compile_row_mapper(serializer_class, prefix='') -> tuple:
+    """
+    Compiles `serializer_class` into the columns to fetch with `.values()` and a function turning one
+    fetched row into the dict the serializer renders for the model instance, keys in the same order.
+
+    Model fields reuse the serializer field's to_representation, nested serializers become `<field>__<column>`
+    lookups and SerializerMethodFields, which have no column, are mapped by the serializer's `values_fields`
+    as `{name: (column, function of the column value)}`
+    """
+    overrides = getattr(serializer_class, 'values_fields', {})
+    columns, entries = [], []
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        if name in overrides:
+            column, convert = overrides[name]
+            entries.append((name, METHOD, prefix + column, convert))
+            columns.append(prefix + column)
+        elif isinstance(field, serializers.ListSerializer) or '.' in field.source or field.source == '*':
+            raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} has no values() mapping, '
+                                       f'declare it in values_fields')
+        elif isinstance(field, serializers.BaseSerializer):
+            nested_columns, nested_map = compile_row_mapper(type(field), prefix=f'{prefix}{field.source}__')
+            # the first nested column must be the related primary key, NULL when there is no related row
+            if nested_columns[0] != f'{prefix}{field.source}__{field.Meta.model._meta.pk.name}':
+                raise ImproperlyConfigured(f'{type(field).__name__} must list the primary key first')
+            entries.append((name, NESTED, nested_columns[0], nested_map))
+            columns += nested_columns
+        else:
+            entries.append((name, FIELD, prefix + field.source, field.to_representation))
+            columns.append(prefix + field.source)
+
+    def map_row(row) -> dict:
+        data = {}
+        for name, kind, column, convert in entries:
+            value = row[column]
+            if kind == METHOD:
+                data[name] = convert(value)
+            elif value is None:
+                # like Serializer.to_representation, None is rendered without calling the field
+                data[name] = None
+            else:
+                data[name] = convert(row) if kind == NESTED else convert(value)
+        return data
+
+    return columns, map_row
+
+
+class ValuesSerializer(object):
+    """
+    Read only stand-in for `serializer_class(rows, many=True)` over rows fetched with `.values(*get_columns())`,
+    rendering the same data as `serializer_class` without building field objects or model instances per row
+    """
+    serializer_class = None
+
+    def __init__(self, instance=None, many=True, context=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @classmethod
+    def get_mapper(cls) -> tuple:
+        if '_mapper' not in cls.__dict__:
+            cls._mapper = compile_row_mapper(cls.serializer_class)
+        return cls._mapper
+
+    @classmethod
+    def get_columns(cls) -> list:
+        return cls.get_mapper()[0]
+
+    @property
+    def data(self):
+        map_row = self.get_mapper()[1]
+        if self.many:
+            return [map_row(row) for row in self.instance]
+        return map_row(self.instance)
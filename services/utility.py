@@ -1,3 +1,5 @@
+import os
+import time
 import uuid
 
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -11,13 +13,18 @@ def get_tokens_for_user(user):
     }
 
 
-def generate_uuid(model, column):
-    unique = str(uuid.uuid4())
-    kwargs = {column: unique}
-    qs_exists = model.objects.filter(**kwargs).exists()
-    if qs_exists:
-        return generate_uuid(model, column)
-    return unique
+def generate_time_ordered_uuid() -> str:
+    """
+    UUIDv7 layout: 48 bit unix millisecond timestamp followed by 74 random bits, unique enough
+    to be used as an identifier without probing the database and sorted by creation time
+    """
+    random_bits = int.from_bytes(os.urandom(10), 'big')
+    value = (time.time_ns() // 1_000_000 & ((1 << 48) - 1)) << 80
+    value |= 0x7 << 76
+    value |= (random_bits >> 68 & 0xFFF) << 64
+    value |= 0b10 << 62
+    value |= random_bits & ((1 << 62) - 1)
+    return str(uuid.UUID(int=value))
 
 
 def error_message_formatter(serializer_errors: dict):
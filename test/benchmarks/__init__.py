@@ -0,0 +1,9 @@
+"""
+Benchmarks, not collected by the default test run.
+
+    python -m pytest test/benchmarks/bench_login.py -s
+    python -m test.benchmarks.load --help
+
+BENCH_LOGIN_USERS and BENCH_LOGIN_REQUESTS size the login benchmark, the result is printed as one JSON line.
+load.py drives a running server seeded with `python manage.py seed_data` and compares runs against a baseline.
+"""
@@ -0,0 +1,56 @@
+"""
+Login throughput benchmark, not collected by the default test run.
+
+    python -m pytest test/benchmarks/bench_login.py -s
+
+BENCH_LOGIN_USERS and BENCH_LOGIN_REQUESTS size the run, the result is printed as one JSON line.
+"""
+import json
+import os
+import statistics
+import time
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from faker import Faker
+
+from core.models import User
+from test.endpoints import EndPoint
+
+fake = Faker()
+
+USERS = int(os.environ.get('BENCH_LOGIN_USERS', 50))
+REQUESTS = int(os.environ.get('BENCH_LOGIN_REQUESTS', 200))
+PASSWORD = '1234567890'
+
+
+@pytest.mark.django_db
+def test_login_throughput(client):
+    emails = []
+    for _ in range(USERS):
+        user = User.objects.create_user(username=fake.uuid4(), email=fake.unique.email(), password=PASSWORD)
+        emails.append(user.email)
+    latencies, user_reads = [], 0
+    started = time.perf_counter()
+    for index in range(REQUESTS):
+        payload = {'username': emails[index % USERS], 'password': PASSWORD}
+        with CaptureQueriesContext(connection) as queries:
+            request_started = time.perf_counter()
+            response = client.post(EndPoint.LOGIN, payload, format='json')
+            latencies.append((time.perf_counter() - request_started) * 1000)
+        assert 'token' in response.data
+        user_reads += len([query for query in queries.captured_queries
+                           if query['sql'].startswith('SELECT') and 'FROM "core_user"' in query['sql']])
+    elapsed = time.perf_counter() - started
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(json.dumps({
+        'benchmark': 'login',
+        'requests': REQUESTS,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(REQUESTS / elapsed, 2),
+        'p50_ms': round(quantiles[49], 2),
+        'p95_ms': round(quantiles[94], 2),
+        'user_reads_per_login': user_reads / REQUESTS,
+    }))
+    assert user_reads == REQUESTS
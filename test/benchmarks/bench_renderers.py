@@ -0,0 +1,61 @@
+"""
+JSON rendering benchmark, DRF's JSONRenderer against ORJSONRenderer on a post list page.
+
+    python -m pytest test/benchmarks/bench_renderers.py -s
+
+BENCH_RENDERER_LIMIT sizes the page (100 by default) and BENCH_RENDERER_ROUNDS how often it is rendered,
+CPU time per response is printed as one JSON line.
+"""
+import json
+import os
+import time
+
+import pytest
+from faker import Faker
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Post, User
+from core.serializer import PostValuesSerializer
+from services.renderers import ORJSONRenderer
+
+fake = Faker()
+
+LIMIT = int(os.environ.get('BENCH_RENDERER_LIMIT', 100))
+ROUNDS = int(os.environ.get('BENCH_RENDERER_ROUNDS', 500))
+
+
+def cpu_ms_per_response(renderer, data) -> float:
+    started = time.process_time()
+    for _ in range(ROUNDS):
+        renderer.render(data)
+    return (time.process_time() - started) * 1000 / ROUNDS
+
+
+@pytest.mark.django_db
+def test_post_list_rendering():
+    users = User.objects.bulk_create([
+        User(username=fake.uuid4(), email=f'bench-{index}@example.com', first_name=fake.first_name())
+        for index in range(10)
+    ])
+    _ = Post.objects.bulk_create([
+        Post(user=users[index % len(users)], title=f'{fake.sentence()} {index}', description=fake.text(),
+             publish=True) for index in range(LIMIT)
+    ])
+    rows = Post.objects.order_by('-created_at', '-id').values(*PostValuesSerializer.get_columns())[:LIMIT]
+    # the shape PostViewSet.list returns for a cursor page
+    data = {'status': status.HTTP_200_OK, 'message': 'OK', 'data': {
+        'status': status.HTTP_200_OK, 'message': 'ok', 'limit': LIMIT, 'next': None,
+        'results': PostValuesSerializer(rows, many=True).data,
+    }}
+    assert ORJSONRenderer().render(data) == JSONRenderer().render(data)
+    json_ms, orjson_ms = cpu_ms_per_response(JSONRenderer(), data), cpu_ms_per_response(ORJSONRenderer(), data)
+    print(json.dumps({
+        'benchmark': 'post_list_rendering',
+        'limit': LIMIT,
+        'rounds': ROUNDS,
+        'bytes': len(JSONRenderer().render(data)),
+        'json_cpu_ms': round(json_ms, 3),
+        'orjson_cpu_ms': round(orjson_ms, 3),
+        'saved_cpu_ms': round(json_ms - orjson_ms, 3),
+    }))
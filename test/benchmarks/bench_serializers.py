@@ -0,0 +1,61 @@
+"""
+Post list serialization benchmark, PostSerializer over model instances against PostValuesSerializer over values() rows.
+
+    python -m pytest test/benchmarks/bench_serializers.py -s
+
+BENCH_SERIALIZER_LIMIT sizes the page (100, the largest cursor page, by default) and BENCH_SERIALIZER_ROUNDS
+how often it is fetched and rendered, the result is printed as one JSON line.
+"""
+import json
+import os
+import time
+
+import pytest
+from faker import Faker
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Post, User
+from core.serializer import PostSerializer, PostValuesSerializer
+
+fake = Faker()
+
+LIMIT = int(os.environ.get('BENCH_SERIALIZER_LIMIT', 100))
+ROUNDS = int(os.environ.get('BENCH_SERIALIZER_ROUNDS', 50))
+
+
+def measure(render) -> float:
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        render()
+    return (time.perf_counter() - started) * 1000 / ROUNDS
+
+
+@pytest.mark.django_db
+def test_post_list_serialization():
+    users = User.objects.bulk_create([
+        User(username=fake.uuid4(), email=f'bench-{index}@example.com', first_name=fake.first_name())
+        for index in range(10)
+    ])
+    _ = Post.objects.bulk_create([
+        Post(user=users[index % len(users)], title=f'{fake.sentence()} {index}', description=fake.text(),
+             publish=True) for index in range(LIMIT)
+    ])
+    queryset = Post.objects.select_related('user').defer('search_vector').order_by('-created_at', '-id')
+
+    def render_instances():
+        return JSONRenderer().render(PostSerializer(list(queryset[:LIMIT]), many=True).data)
+
+    def render_rows():
+        rows = list(queryset.values(*PostValuesSerializer.get_columns())[:LIMIT])
+        return JSONRenderer().render(PostValuesSerializer(rows, many=True).data)
+
+    assert render_instances() == render_rows()
+    serializer_ms, values_ms = measure(render_instances), measure(render_rows)
+    print(json.dumps({
+        'benchmark': 'post_list_serialization',
+        'limit': LIMIT,
+        'rounds': ROUNDS,
+        'post_serializer_ms': round(serializer_ms, 2),
+        'values_serializer_ms': round(values_ms, 2),
+        'speedup': round(serializer_ms / values_ms, 2),
+    }))
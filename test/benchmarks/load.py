@@ -0,0 +1,219 @@
+"""
+Load test and latency benchmark against a running server, standard library only so it can run from any box.
+
+    python manage.py seed_data --users 100000 --posts 1000000 --comments 10000000
+    python -m test.benchmarks.load --base-url http://localhost:8000 --concurrency 32 --requests 5000 \\
+        --output results.json --baseline test/benchmarks/baseline.json
+
+Every scenario reports throughput, error rate and p50/p95/p99 latency as JSON. With --baseline the run is
+compared against a stored result and exits with status 1 when a scenario regressed by more than --tolerance,
+--save-baseline stores the run as the new reference (keep baselines per machine, they are not portable).
+"""
+import argparse
+import http.client
+import json
+import math
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+# must match core/management/commands/seed_data.py
+SEED_EMAIL_TEMPLATE = 'seed-user-{index}@example.com'
+SEED_PASSWORD = 'seed-password'
+
+SCENARIOS = ('post_list', 'post_list_cursor', 'post_detail', 'comment_list', 'login')
+
+
+class Client(object):
+    """One keep-alive connection per worker thread, reopened whenever the server drops it"""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc, self.timeout = parts.netloc, timeout
+        self.local = threading.local()
+
+    def get_connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = self.connection_class(self.netloc, timeout=self.timeout)
+        return self.local.connection
+
+    def close(self):
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+            self.local.connection = None
+
+    def request(self, method, path, payload=None) -> tuple:
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        try:
+            connection = self.get_connection()
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            content = response.read()
+            if response.getheader('Connection', '').lower() == 'close':
+                self.close()
+            return response.status, content
+        except (http.client.HTTPException, OSError):
+            self.close()
+            raise
+
+
+def discover_post_ids(client, pages) -> list:
+    """Walks the newest posts with the cursor endpoint, the ids feed the detail and comment scenarios"""
+    post_ids, cursor = [], ''
+    for _ in range(pages):
+        status, content = client.request('GET', f'/api/v1/post/?cursor={cursor}&limit=100')
+        if status != 200:
+            break
+        data = json.loads(content)['data']
+        post_ids += [post['id'] for post in data['results']]
+        cursor = data['next']
+        if not cursor:
+            break
+    return post_ids
+
+
+def build_scenarios(args, post_ids) -> dict:
+    """Every scenario is a callable returning (method, path, payload) for the next request"""
+    return {
+        'post_list': lambda: ('GET', f'/api/v1/post/?page={random.randint(1, args.max_page)}', None),
+        'post_list_cursor': lambda: ('GET', '/api/v1/post/?cursor=&limit=20', None),
+        'post_detail': lambda: ('GET', f'/api/v1/post/{random.choice(post_ids)}/', None),
+        'comment_list': lambda: ('GET', f'/api/v1/post/comment/?post__id={random.choice(post_ids)}', None),
+        'login': lambda: ('POST', '/api/v1/auth/login/', {
+            'username': SEED_EMAIL_TEMPLATE.format(index=random.randrange(args.users)),
+            'password': args.password,
+        }),
+    }
+
+
+def percentile(values, rank) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(rank / 100 * len(values)) - 1)]
+
+
+def summarize(latencies, errors, elapsed) -> dict:
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+    }
+
+
+def run_scenario(client, next_request, requests, concurrency, warmup) -> dict:
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def send(record):
+        method, path, payload = next_request()
+        started = time.perf_counter()
+        try:
+            status, _ = client.request(method, path, payload)
+        except (http.client.HTTPException, OSError):
+            status = None
+        duration = (time.perf_counter() - started) * 1000
+        if not record:
+            return
+        with lock:
+            if status is not None and 200 <= status < 300:
+                latencies.append(duration)
+            else:
+                errors[0] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: send(False), range(warmup)))
+        started = time.perf_counter()
+        list(executor.map(lambda _: send(True), range(requests)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, errors[0], elapsed)
+
+
+def compare(results, baseline, tolerance) -> list:
+    """Regressions of every scenario present in both runs, as human readable lines"""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        reference = baseline.get('scenarios', {}).get(name)
+        if reference is None:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if reference[key] and current[key] > reference[key] * (1 + tolerance):
+                regressions.append(f'{name}: {key} {current[key]} > {reference[key]} (+{tolerance:.0%})')
+        if current['throughput_rps'] < reference['throughput_rps'] * (1 - tolerance):
+            regressions.append(f'{name}: throughput_rps {current["throughput_rps"]} < '
+                               f'{reference["throughput_rps"]} (-{tolerance:.0%})')
+        if current['error_rate'] > reference['error_rate'] + 0.01:
+            regressions.append(f'{name}: error_rate {current["error_rate"]} > {reference["error_rate"]}')
+    return regressions
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Load test the blog API and report latency percentiles')
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, dest='scenarios',
+                        help='Repeat to run several, every scenario runs when omitted')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000, help='Measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=100, help='Unmeasured requests sent before each scenario')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--max-page', type=int, default=50, help='post_list picks a page in [1, max-page]')
+    parser.add_argument('--discover-pages', type=int, default=20, help='Cursor pages walked to collect post ids')
+    parser.add_argument('--users', type=int, default=1000, help='Seeded users login picks from')
+    parser.add_argument('--password', default=SEED_PASSWORD)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Also write the JSON result to this file')
+    parser.add_argument('--baseline', help='Compare against this stored result')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed relative regression')
+    parser.add_argument('--save-baseline', help='Store this run as the reference result')
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+    random.seed(args.seed)
+    client = Client(args.base_url, args.timeout)
+    scenario_names = args.scenarios or list(SCENARIOS)
+    post_ids = discover_post_ids(client, args.discover_pages)
+    if not post_ids and {'post_detail', 'comment_list'}.intersection(scenario_names):
+        sys.stderr.write('No posts found, seed the database first (python manage.py seed_data)\n')
+        return 2
+    scenarios = build_scenarios(args, post_ids)
+    results = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'base_url': args.base_url,
+        'concurrency': args.concurrency,
+        'scenarios': {},
+    }
+    for name in scenario_names:
+        results['scenarios'][name] = run_scenario(client, scenarios[name], args.requests, args.concurrency,
+                                                  args.warmup)
+    output = json.dumps(results, indent=2)
+    print(output)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as stream:
+            stream.write(output + '\n')
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as stream:
+        regressions = compare(results, json.load(stream), args.tolerance)
+    for regression in regressions:
+        sys.stderr.write(f'REGRESSION {regression}\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
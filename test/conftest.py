@@ -1,13 +1,154 @@
+import re
+from contextlib import contextmanager
+
 import pytest
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from faker import Faker
-from core.models import User, Post
-from services.utility import generate_uuid
+from core.models import User, Post, Comment
+from services.routers import PrimaryReplicaRouter, is_pinned_to_primary
+from services.utility import generate_time_ordered_uuid
 from test.endpoints import EndPoint
 
 fake = Faker()
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """
+    cached pages and post payloads are keyed by database ids, so they must not leak between tests
+    """
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def replica_reads_only_when_requested(request, settings):
+    """
+    a test only gets a connection to the databases its django_db mark lists, tests that do not list a replica
+    read everything from the primary
+    """
+    marker = request.node.get_closest_marker('django_db')
+    databases = marker.kwargs.get('databases', ()) if marker is not None else ()
+    if databases != '__all__':
+        settings.REPLICA_DATABASES = [alias for alias in settings.REPLICA_DATABASES if alias in databases]
+
+
+@pytest.fixture
+def assert_no_seq_scan():
+    """
+    explains the captured queries touching the given table with sequential scans disabled, postgres still
+    falls back to one when no index can serve the query, so a seq scan in the plan means a missing index.
+    Any index scan would pass that check, a full scan of an unrelated index included, so every index the
+    endpoint is expected to use must also show up in the plans, index names are matched as regular expressions
+    """
+
+    def check(captured_queries, table, *indexes):
+        plans = []
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            for query in captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or f'"{table}"' not in sql:
+                    continue
+                cursor.execute(f'EXPLAIN {sql}')
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                assert 'Seq Scan' not in plan, f'{sql}\n{plan}'
+                plans.append(plan)
+        assert plans, f'no query on {table} was captured'
+        for index in indexes:
+            # index scans read `using <index> on <table>`, bitmap index scans `Bitmap Index Scan on <index>`
+            assert any(re.search(rf'using {index} on {table}\b|Bitmap Index Scan on {index}\b', plan)
+                       for plan in plans), f'{index} is not used:\n' + '\n\n'.join(plans)
+
+    return check
+
+
+@pytest.fixture
+def query_budget():
+    """
+    context manager failing the test when the block runs more SQL than the viewset declares in query_budgets
+    for the action, the failure lists every statement that ran
+    """
+
+    @contextmanager
+    def check(viewset_class, action):
+        budget = viewset_class.query_budgets[action]
+        with CaptureQueriesContext(connection) as queries:
+            yield queries
+        executed = [query['sql'] for query in queries.captured_queries]
+        assert len(executed) <= budget, \
+            f'{viewset_class.__name__}.{action} ran {len(executed)} queries, its budget is {budget}:\n' + \
+            '\n'.join(f'{index}. {sql}' for index, sql in enumerate(executed, 1))
+
+    return check
+
+
+@pytest.fixture
+def async_cache(monkeypatch):
+    """
+    dict standing in for the async views' redis client, which the test settings do not reach
+    """
+    store = {}
+
+    async def cache_get(key):
+        return store.get(key)
+
+    async def cache_set(key, value, timeout):
+        store[key] = value
+
+    monkeypatch.setattr('core.async_views.async_cache_get', cache_get)
+    monkeypatch.setattr('core.async_views.async_cache_set', cache_set)
+    return store
+
+
+@pytest.fixture
+def asgi_get():
+    """
+    sends a GET through config.asgi's application, the handler a production ASGI server runs, and returns
+    the status, headers and the body of every response message
+    """
+    from config.asgi import application
+
+    async def send(path, query_string='', headers=()):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+            'headers': [(b'host', b'testserver'), *((name.encode(), value.encode()) for name, value in headers)],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        communicator = ApplicationCommunicator(application, scope)
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(10)
+        body, message = b'', {'more_body': True}
+        while message.get('more_body', False):
+            message = await communicator.receive_output(10)
+            body += message.get('body', b'')
+        await communicator.wait(10)
+        return start['status'], {name.decode(): value.decode() for name, value in start['headers']}, body
+
+    return async_to_sync(send)
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """
+    records, for every read the router places, whether it was pinned to the primary
+    """
+    routed = []
+    db_for_read = PrimaryReplicaRouter.db_for_read
+
+    def record(router, model, **hints):
+        routed.append(is_pinned_to_primary())
+        return db_for_read(router, model, **hints)
+
+    monkeypatch.setattr(PrimaryReplicaRouter, 'db_for_read', record)
+    return routed
+
+
 @pytest.fixture
 def client():
     """
@@ -38,7 +179,7 @@ def setup_user_data():
         'last_name': fake.last_name(),
         'email': fake.email(),
         'address': fake.address(),
-        'username': generate_uuid(User, 'username'),
+        'username': generate_time_ordered_uuid(),
         'password': '123456'
     }
     instance = User.objects.create_user(username=data.get('username'), email=data.get('email'),
@@ -90,3 +231,56 @@ def setup_post_data(setup_user_data):
     }
     post = Post.objects.create(**data)
     return post, user_info
+
+
+@pytest.mark.django_db
+@pytest.fixture
+def large_dataset(setup_user_data):
+    """
+    enough authors, posts and nested comments that a query issued per row shows up as dozens of statements,
+    the first post holds a three level comment thread. Every description mentions `dataset`, a word full text
+    search keeps, unlike the stopwords faker's sentences may be made of
+    """
+    owner, _ = setup_user_data
+    users = [owner] + User.objects.bulk_create([
+        User(username=generate_time_ordered_uuid(), email=f'author-{index}@example.com', first_name=fake.first_name())
+        for index in range(11)
+    ])
+    posts = Post.objects.bulk_create([
+        Post(user=user, title=f'{fake.sentence()} {index}', description=f"{' '.join(fake.sentences())} dataset",
+             publish=index % 2 == 0)
+        for index, user in enumerate(users * 5)
+    ])
+    for post in posts[:3]:
+        for _ in range(4):
+            root = Comment.objects.create(post=post, user=users[1], body=fake.sentence())
+            for reply_user in users[2:4]:
+                reply = Comment.objects.create(parent_comment=root, user=reply_user, body=fake.sentence())
+                for _ in range(2):
+                    _ = Comment.objects.create(parent_comment=reply, user=owner, body=fake.sentence())
+    return owner, posts
+
+
+@pytest.fixture
+def plan_dataset(setup_user_data):
+    """
+    enough rows, analyzed, for the planner to cost the indexes as it would in production. On a handful of rows
+    every plan costs about the same and the index picked depends on whatever statistics earlier tests left
+    """
+    owner, _ = setup_user_data
+    users = [owner] + User.objects.bulk_create([
+        User(username=generate_time_ordered_uuid(), email=f'planner-{index}@example.com') for index in range(49)
+    ])
+    posts = Post.objects.bulk_create([
+        Post(user=users[index % len(users)], title=f'post {index}', description=fake.sentence(),
+             publish=index % 2 == 0)
+        for index in range(5000)
+    ])
+    _ = Comment.objects.bulk_create([
+        Comment(post=posts[index // 1000], user=users[index % len(users)], body=fake.sentence(),
+                path=Comment.build_path(index + 1))
+        for index in range(5000)
+    ])
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE core_user, core_post, core_comment')
+    return owner, posts
@@ -10,3 +10,6 @@ class EndPoint(CustomEnum):
     LOGIN = f'{settings.BASE_URL}/api/v1/auth/login/'
     POST = f'{settings.BASE_URL}/api/v1/post'
     COMMENT = f'{settings.BASE_URL}/api/v1/post/comment'
+    ASYNC_POST = f'{settings.BASE_URL}/api/v1/async/post'
+    ASYNC_COMMENT = f'{settings.BASE_URL}/api/v1/async/post/comment'
+    METRICS = f'{settings.BASE_URL}/metrics'
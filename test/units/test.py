@@ -1,8 +1,39 @@
+import importlib
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+
 import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.postgres.search import SearchQuery
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.utils.translation import gettext_lazy
 from django.utils.text import slugify
 from faker import Faker
-from core.models import Post, Comment
-from core.serializer import UserSerializer, PostSerializer, CommentSerializer
+from core.models import Post, Comment, User
+from core.signal import evict_user_caches
+from core.serializer import UserSerializer, PostSerializer, PostValuesSerializer, CommentSerializer
+from PIL import Image
+from prometheus_client import REGISTRY
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.renderers import JSONRenderer
+from django.contrib.sessions.models import Session
+from services.compression import negotiate_encoding
+from services.images import IMAGE_VARIANTS, generate_image_variants
+from services.log import QueuedJsonFileHandler, TracebackRateLimiter, format_exc
+from services.renderers import ORJSONParser, ORJSONRenderer
+from services.async_cache import run_blocking
+from services.authentication import get_cached_user
+from services.routers import PRIMARY_DATABASE, PrimaryReplicaRouter, pin_to_primary, reset_routing_state
+from services.utility import generate_time_ordered_uuid
+from test.benchmarks.load import compare, percentile, summarize
 
 fake = Faker()
 
@@ -16,6 +47,67 @@ def test_user_model_with_serializer(setup_user_data):
                                                                       serializer.get('last_name')]
 
 
+@pytest.mark.django_db
+def test_user_email_is_unique_regardless_of_case(setup_user_data):
+    """The index holds for writes that bypass User.save(), which lower cases the email"""
+    user, _ = setup_user_data
+    with pytest.raises(IntegrityError, match='user_email_unique'), transaction.atomic():
+        _ = User.objects.bulk_create([User(username='shouting', email=user.email.upper())])
+    other = User.objects.create(username='other', email='other@example.com')
+    with pytest.raises(IntegrityError, match='user_email_unique'), transaction.atomic():
+        _ = User.objects.filter(id=other.id).update(email=user.email.title())
+    # accounts without an email are not constrained
+    assert len(User.objects.bulk_create([User(username='blank-1', email=''), User(username='blank-2', email='')])) == 2
+
+
+def test_generate_time_ordered_uuid():
+    identifiers = [generate_time_ordered_uuid() for _ in range(1000)]
+    assert len(set(identifiers)) == 1000
+    assert all(uuid.UUID(identifier).version == 7 for identifier in identifiers)
+    assert identifiers[0][:8] <= identifiers[-1][:8]
+
+
+class TestPrimaryReplicaRouter:
+    @pytest.fixture
+    def router(self, settings):
+        settings.REPLICA_DATABASES = ['replica']
+        reset_routing_state()
+        yield PrimaryReplicaRouter()
+        reset_routing_state()
+
+    def test_reads_go_to_replica_and_writes_to_primary(self, router):
+        assert router.db_for_read(Post) == 'replica'
+        assert router.db_for_write(Post) == PRIMARY_DATABASE
+
+    def test_reads_stay_on_primary_after_a_write(self, router):
+        _ = router.db_for_write(Comment)
+        assert router.db_for_read(Post) == PRIMARY_DATABASE
+        reset_routing_state()
+        assert router.db_for_read(Post) == 'replica'
+
+    def test_only_application_models_are_routed(self, router):
+        assert router.db_for_read(Session) is None
+        _ = router.db_for_write(Session)
+        assert router.db_for_read(Post) == 'replica'
+
+    def test_pool_work_runs_in_a_copy_of_the_request_context(self, router):
+        async def request(pinned):
+            if pinned:
+                pin_to_primary()
+            # the write pins the copy of the context it ran in, not the next work sent to the pool
+            _ = await run_blocking(router.db_for_write, Comment)
+            return await run_blocking(router.db_for_read, Post)
+
+        assert async_to_sync(request)(pinned=True) == PRIMARY_DATABASE
+        reset_routing_state()
+        assert async_to_sync(request)(pinned=False) == 'replica'
+
+    def test_without_replica_everything_uses_primary(self, router, settings):
+        settings.REPLICA_DATABASES = []
+        assert router.db_for_read(Post) == PRIMARY_DATABASE
+        assert router.allow_migrate('replica', 'core') is False
+
+
 class TestPostComment:
     @pytest.mark.django_db
     def test_post_model(self, setup_user_data):
@@ -30,6 +122,19 @@ class TestPostComment:
         slug = slugify(data.get('title'))
         assert slug == post.slug
 
+    @pytest.mark.django_db
+    def test_post_search_vector_follows_every_write(self, setup_user_data):
+        user, _ = setup_user_data
+        created = Post.objects.create(user=user, title='created lighthouse', description='')
+        bulk = Post.objects.bulk_create([Post(user=user, title='bulk', description='lighthouse keeper')])[0]
+        updated = Post.objects.create(user=user, title='updated', description='')
+        Post.objects.filter(id=updated.id).update(description='a lighthouse')
+        query = SearchQuery('lighthouse', config=Post.SEARCH_CONFIG)
+        matches = set(Post.objects.filter(search_vector=query).values_list('id', flat=True))
+        assert matches == {created.id, bulk.id, updated.id}
+        Post.objects.filter(id=created.id).update(title='created')
+        assert not Post.objects.filter(id=created.id, search_vector=query).exists()
+
     @pytest.mark.django_db
     def test_post_serializer(self, setup_user_data):
         user, _ = setup_user_data
@@ -69,3 +174,211 @@ class TestPostComment:
         comments = Comment.objects.filter(post=post)
         _ = CommentSerializer(comments, many=True).data
         assert comments.count() == 5
+
+    @pytest.mark.django_db
+    def test_comment_reply_path(self, setup_post_data, setup_user_data):
+        post, _ = setup_post_data
+        user, _ = setup_user_data
+        comment = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        reply = Comment.objects.create(parent_comment=comment, user=user, body=fake.sentence())
+        comment.refresh_from_db()
+        assert reply.post_id == post.id and reply.depth == 1
+        assert reply.path.startswith(comment.path) and comment.reply_count == 1
+        reply.delete()
+        comment.refresh_from_db()
+        assert comment.reply_count == 0
+
+    @pytest.mark.django_db
+    def test_migration_backfills_comment_paths(self, setup_post_data, setup_user_data):
+        post, _ = setup_post_data
+        user, _ = setup_user_data
+        comment = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        reply = Comment.objects.create(parent_comment=comment, user=user, body=fake.sentence())
+        nested = Comment.objects.create(parent_comment=reply, user=user, body=fake.sentence())
+        expected = {row['id']: row for row in Comment.objects.values('id', 'path', 'depth', 'reply_count')}
+        Comment.objects.update(path='', depth=0, reply_count=0)
+        migration = importlib.import_module('core.migrations.0004_backfill_comment_paths')
+        migration.backfill_comment_paths(None, connection.schema_editor())
+        assert {row['id']: row for row in Comment.objects.values('id', 'path', 'depth', 'reply_count')} == expected
+        assert Comment.objects.get(id=nested.id).path == Comment.build_path(nested.id, reply.path)
+
+    @pytest.mark.django_db
+    def test_post_comment_count(self, setup_post_data, setup_user_data):
+        post, _ = setup_post_data
+        user, _ = setup_user_data
+        comment = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        for _ in range(3):
+            _ = Comment.objects.create(parent_comment=comment, user=user, body=fake.sentence())
+        post.refresh_from_db()
+        assert post.comment_count == 4 and PostSerializer(post).data['comment_count'] == 4
+        comment.delete()
+        post.refresh_from_db()
+        assert post.comment_count == 0
+
+    @pytest.mark.django_db
+    def test_repair_comment_counts(self, setup_post_data, setup_user_data):
+        post, _ = setup_post_data
+        user, _ = setup_user_data
+        for _ in range(2):
+            _ = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        Post.objects.filter(id=post.id).update(comment_count=7)
+        call_command('repair_comment_counts')
+        post.refresh_from_db()
+        assert post.comment_count == 2
+
+    @pytest.mark.django_db
+    def test_post_image_variants(self, setup_post_data, django_capture_on_commit_callbacks):
+        post, _ = setup_post_data
+        buffer = BytesIO()
+        Image.new('RGB', (2400, 1600), 'white').save(buffer, format='JPEG')
+        with django_capture_on_commit_callbacks() as callbacks:
+            post.image.save('variant.jpg', ContentFile(buffer.getvalue()))
+        assert len(callbacks) == 1
+        variants = generate_image_variants(Post, post.id, 'image', 'image_variants')
+        post.refresh_from_db()
+        assert post.image_variants == variants and variants['source'] == post.image.name
+        for name, spec in IMAGE_VARIANTS.items():
+            with default_storage.open(variants[name]) as variant, Image.open(variant) as image:
+                assert image.format == spec['format'] and max(image.size) == max(spec['size'])
+        assert set(PostSerializer(post).data['image_variants']) == set(IMAGE_VARIANTS)
+
+    @pytest.mark.django_db
+    def test_avatar_variants_evict_the_cached_user(self, setup_user_data, django_capture_on_commit_callbacks):
+        user, _ = setup_user_data
+        buffer = BytesIO()
+        Image.new('RGB', (800, 800), 'white').save(buffer, format='JPEG')
+        with django_capture_on_commit_callbacks() as callbacks:
+            user.avatar.save('avatar.jpg', ContentFile(buffer.getvalue()))
+        assert len(callbacks) == 1 and get_cached_user(user.id).avatar_variants == {}
+        variants = generate_image_variants(User, user.id, 'avatar', 'avatar_variants', on_complete=evict_user_caches)
+        assert get_cached_user(user.id).avatar_variants == variants
+
+    @pytest.mark.django_db
+    def test_export_comments_command(self, setup_post_data, setup_user_data):
+        post, _ = setup_post_data
+        user, _ = setup_user_data
+        for _ in range(3):
+            _ = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        out = StringIO()
+        call_command('export_data', 'comments', '--filter', f'post__id={post.id}', '--format', 'csv', stdout=out)
+        rows = out.getvalue().splitlines()
+        assert len(rows) == 4 and rows[0].startswith('id,post_id')
+
+
+@pytest.mark.django_db
+def test_seed_data_command():
+    call_command('seed_data', '--users', '3', '--posts', '10', '--comments', '30', '--batch-size', '7',
+                 stdout=StringIO())
+    assert Post.objects.count() == 10 and Comment.objects.count() == 30
+    comments = {comment.id: comment for comment in Comment.objects.all()}
+    for comment in comments.values():
+        if comment.parent_comment_id is None:
+            assert comment.depth == 0 and comment.path == Comment.build_path(comment.id)
+        else:
+            parent = comments[comment.parent_comment_id]
+            assert comment.post_id == parent.post_id and comment.depth == parent.depth + 1
+            assert comment.path == Comment.build_path(comment.id, parent.path)
+    for comment in comments.values():
+        assert comment.reply_count == sum(reply.parent_comment_id == comment.id for reply in comments.values())
+    for post in Post.objects.all():
+        assert post.comment_count == sum(comment.post_id == post.id for comment in comments.values())
+
+
+def test_load_benchmark_summary():
+    assert percentile([], 50) == 0.0
+    assert [percentile(list(range(1, 101)), rank) for rank in (50, 95, 99)] == [50, 95, 99]
+    summary = summarize([30.0, 10.0, 20.0], errors=1, elapsed=2)
+    assert summary['requests'] == 4 and summary['error_rate'] == 0.25 and summary['p50_ms'] == 20.0
+    baseline = {'scenarios': {'post_list': summary}}
+    assert compare({'scenarios': {'post_list': summary}}, baseline, 0.15) == []
+    slower = dict(summary, p95_ms=summary['p95_ms'] * 2)
+    assert compare({'scenarios': {'post_list': slower}}, baseline, 0.15)[0].startswith('post_list: p95_ms')
+
+
+def test_format_exc_rate_limits_variable_dumps(settings, monkeypatch):
+    settings.LOG_TRACEBACK_VARIABLES_LIMIT, settings.LOG_TRACEBACK_VARIABLES_WINDOW = 2, 60
+    monkeypatch.setattr('services.log._limiter', TracebackRateLimiter())
+    tracebacks = []
+    for _ in range(4):
+        try:
+            secret_local = 'rendered with the variables'  # noqa: F841
+            raise ValueError('boom')
+        except ValueError as ex:
+            tracebacks.append(format_exc(ex))
+    assert all('secret_local' in traceback for traceback in tracebacks[:2])
+    assert all('secret_local' not in traceback and 'ValueError: boom' in traceback for traceback in tracebacks[2:])
+
+
+def test_queued_json_file_handler(tmp_path):
+    handler = QueuedJsonFileHandler(str(tmp_path / 'core.log'), queue_size=100)
+    logger = logging.getLogger('test.queued')
+    logger.addHandler(handler)
+    try:
+        logger.error('failed %s', 'export', extra={'user_id': 7})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('with traceback')
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+    lines = [json.loads(line) for line in (tmp_path / 'core.log').read_text().splitlines()]
+    assert [line['message'] for line in lines] == ['failed export', 'with traceback']
+    assert lines[0]['user_id'] == 7 and lines[0]['level'] == 'ERROR'
+    assert 'ValueError: boom' in lines[1]['exception']
+
+
+def test_queued_json_file_handler_drops_when_full(tmp_path):
+    handler = QueuedJsonFileHandler(str(tmp_path / 'core.log'), queue_size=1)
+    handler.listener.stop()
+    dropped = REGISTRY.get_sample_value('log_records_dropped_total')
+    for index in range(3):
+        handler.handle(logging.makeLogRecord({'msg': f'record {index}', 'levelno': logging.ERROR}))
+    assert handler.dropped == 2
+    assert REGISTRY.get_sample_value('log_records_dropped_total') == dropped + 2
+    handler.listener.start()
+    handler.close()
+    assert json.loads((tmp_path / 'core.log').read_text())['message'] == 'record 0'
+
+
+@pytest.mark.django_db
+def test_post_values_serializer_matches_post_serializer(large_dataset):
+    owner, posts = large_dataset
+    User = type(owner)
+    _ = User.objects.filter(id=owner.id).update(address=None, avatar_variants={'thumbnail': 'profile/a.jpg'})
+    _ = Post.objects.filter(id=posts[0].id).update(image='blog/cover.jpg', image_variants={
+        'source': 'blog/cover.jpg', 'thumbnail': 'blog/variants/cover-thumbnail.jpg'})
+    queryset = Post.objects.select_related('user').order_by('-created_at', '-id')
+    expected = JSONRenderer().render(PostSerializer(queryset, many=True).data)
+    rows = queryset.values(*PostValuesSerializer.get_columns())
+    assert JSONRenderer().render(PostValuesSerializer(rows, many=True).data) == expected
+    assert b'/blog/cover.jpg' in expected and b'"address":null' in expected
+
+
+def test_orjson_renderer_matches_json_renderer():
+    data = OrderedDict(
+        aware=datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc), naive=datetime(2024, 5, 1, 12, 30),
+        day=date(2024, 5, 1), clock=time(8, 15, 30), amount=Decimal('12.50'), identifier=uuid.uuid4(),
+        lazy=gettext_lazy('Not found.'), error=[ErrorDetail('This field is required.', code='required')],
+        nested={1: ['ünïcode', 'line\u2028separator', None, True, 1.5]},
+    )
+    assert ORJSONRenderer().render(data) == JSONRenderer().render(data)
+    assert ORJSONRenderer().render(data, 'application/json; indent=2') == \
+        JSONRenderer().render(data, 'application/json; indent=2')
+    assert ORJSONRenderer().render(None) == b''
+
+
+def test_orjson_parser():
+    assert ORJSONParser().parse(BytesIO('{"title": "ünïcode", "ids": [1, 2]}'.encode())) == \
+        {'title': 'ünïcode', 'ids': [1, 2]}
+    with pytest.raises(ParseError):
+        ORJSONParser().parse(BytesIO(b'{"title": '))
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    ('', 'identity'), ('gzip', 'gzip'), ('gzip, deflate, br', 'br'), ('br;q=0.5, gzip;q=0.8', 'gzip'),
+    ('BR', 'br'), ('*', 'br'), ('*, br;q=0', 'gzip'), ('deflate', 'identity'), ('gzip;q=0', 'identity'),
+    ('gzip;q=nonsense, br', 'br'),
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
@@ -1,9 +1,32 @@
+import csv
+import gzip
+import json
 import os
 import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+import brotli
 import pytest
+from asgiref import sync
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.utils.text import slugify
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
 from faker import Faker
 from core.models import Post, Comment, User
+from core.views import AuthViewSet, PostCommentViewSet, PostViewSet
+from rest_framework.test import APIClient
+from prometheus_client import REGISTRY
+from services import compression, profiling
+from services.cache import get_page_lock_key
+from services.metrics import MULTIPROCESS_ENV
+from services.routers import user_is_pinned
+from silk.models import Request as SilkRequest
 from test.endpoints import EndPoint
 
 fake = Faker()
@@ -18,6 +41,13 @@ class TestAuthentication:
         response = client.post(f'{EndPoint.REGISTER}', payload, format='json')
         assert response.status_code == 201 and response.data['message'] == 'Account created successfully'
 
+    def test_user_create_account_is_a_single_insert(self, client, dummy_user_data):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(f'{EndPoint.REGISTER}', dummy_user_data, format='json')
+        user_queries = [query for query in queries.captured_queries if '"core_user"' in query['sql']]
+        assert response.status_code == 201
+        assert len(user_queries) == 1 and user_queries[0]['sql'].startswith('INSERT')
+
     def test_user_create_account_fail(self, client):
         """
         This test case handle testing if serializer validation for each field is working
@@ -31,6 +61,43 @@ class TestAuthentication:
         response = client.post(f'{EndPoint.REGISTER}', payload, format='json')
         assert response.status_code == 400
 
+    def test_login_with_mixed_case_email(self, client, setup_user_data):
+        _, user_info = setup_user_data
+        payload = {'username': user_info.get('email').upper(), 'password': user_info.get('password')}
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(f'{EndPoint.LOGIN}', payload, format='json')
+        user_queries = [query for query in queries.captured_queries
+                        if query['sql'].startswith('SELECT') and 'FROM "core_user"' in query['sql']]
+        assert 'token' in response.data and len(user_queries) == 1
+
+    def test_login_with_username(self, client, setup_user_data):
+        _, user_info = setup_user_data
+        payload = {'username': user_info.get('username'), 'password': user_info.get('password')}
+        response = client.post(f'{EndPoint.LOGIN}', payload, format='json')
+        assert 'token' in response.data
+
+    def test_user_create_account_email_already_exist_with_different_case(self, client, dummy_user_data):
+        payload = dummy_user_data
+        _ = client.post(f'{EndPoint.REGISTER}', payload, format='json')
+        payload.update({'email': payload['email'].upper()})
+        _response = client.post(f'{EndPoint.REGISTER}', payload, format='json')
+        assert 'Email already exist' in str(_response.data)
+
+    def test_jwt_user_is_resolved_from_cache(self, auth_client):
+        _ = auth_client.get(f'{EndPoint.POST}/export/', format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = auth_client.get(f'{EndPoint.POST}/export/', format='json')
+        assert response.status_code == 200
+        assert not [query for query in queries.captured_queries if 'FROM "core_user"' in query['sql']]
+
+    def test_jwt_user_cache_evicted_on_deactivation(self, auth_client, setup_user_data):
+        user, _ = setup_user_data
+        _ = auth_client.get(f'{EndPoint.POST}/export/', format='json')
+        user.is_active = False
+        user.save()
+        response = auth_client.get(f'{EndPoint.POST}/export/', format='json')
+        assert response.status_code in (401, 403)
+
     def test_user_create_account_email_already_exist(self, client, dummy_user_data):
         """
         This test case handle testing the uniqueness of email
@@ -68,6 +135,90 @@ class TestPost:
         data = response.data['data']['results']
         assert len(data) == 0
 
+    def test_list_post_with_cursor(self, client, dummy_posts):
+        _, posts = dummy_posts
+        response = client.get(f'{EndPoint.POST}/?cursor=&limit=2', format='json')
+        data = response.data['data']
+        seen = [item['id'] for item in data['results']]
+        while data['next'] is not None:
+            response = client.get(f'{EndPoint.POST}/?cursor={data["next"]}&limit=2', format='json')
+            data = response.data['data']
+            seen.extend(item['id'] for item in data['results'])
+        assert seen == list(posts.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_list_post_with_cursor_limit_is_capped(self, client, dummy_posts):
+        response = client.get(f'{EndPoint.POST}/?cursor=&limit=100000', format='json')
+        assert response.data['data']['limit'] == 100
+
+    def test_list_post_with_invalid_cursor(self, client, dummy_posts):
+        response = client.get(f'{EndPoint.POST}/?cursor=not-a-cursor', format='json')
+        assert response.data['data']['status'] == 400
+
+    def test_list_post_with_full_text_search(self, client, dummy_posts):
+        user, _ = dummy_posts
+        by_description = Post.objects.create(user=user, title=fake.name(), publish=True,
+                                             description='Notes on the migrating albatross')
+        by_title = Post.objects.create(user=user, title='Albatross sightings', publish=True,
+                                       description=fake.sentence())
+        response = client.get(f'{EndPoint.POST}/?q=albatrosses', format='json')
+        data = response.data['data']['results']
+        assert [item['id'] for item in data] == [by_title.id, by_description.id]
+
+    def test_list_post_with_full_text_search_and_filter(self, client, dummy_posts):
+        user, _ = dummy_posts
+        _ = Post.objects.create(user=user, title='Albatross sightings', publish=True, description=fake.sentence())
+        response = client.get(f'{EndPoint.POST}/?q=albatross&publish=0', format='json')
+        assert len(response.data['data']['results']) == 0
+
+    def test_list_post_cache_invalidated_on_write(self, client, dummy_posts):
+        user, posts = dummy_posts
+        response = client.get(f'{EndPoint.POST}/', format='json')
+        total = response.data['data']['total']
+        post = Post.objects.create(user=user, title=fake.name(), publish=True, description=fake.sentence())
+        response = client.get(f'{EndPoint.POST}/', format='json')
+        assert response.data['data']['total'] == total + 1
+        post.delete()
+        response = client.get(f'{EndPoint.POST}/', format='json')
+        assert response.data['data']['total'] == total
+
+    def test_retrieve_post_is_served_from_cache(self, client, dummy_posts):
+        _, posts = dummy_posts
+        post = posts.first()
+        response = client.get(f'{EndPoint.POST}/{post.id}/', format='json')
+        assert response.status_code == 200
+        with CaptureQueriesContext(connection) as queries:
+            cached_response = client.get(f'{EndPoint.POST}/{post.id}/', format='json')
+        assert not [query for query in queries.captured_queries if 'core_post' in query['sql']]
+        assert cached_response.data['data'] == response.data['data']
+
+    def test_retrieve_post_cache_is_not_filled_with_a_payload_older_than_a_write(self, client, dummy_posts,
+                                                                                  monkeypatch):
+        _, posts = dummy_posts
+        post = posts.first()
+        get_object = PostViewSet.get_object
+
+        def get_object_then_write(view):
+            instance = get_object(view)
+            # commits while the reader builds the payload from what it read
+            written = Post.objects.get(id=instance.id)
+            written.title = 'written meanwhile'
+            written.save()
+            return instance
+
+        monkeypatch.setattr(PostViewSet, 'get_object', get_object_then_write)
+        assert client.get(f'{EndPoint.POST}/{post.id}/', format='json').data['data']['title'] == post.title
+        monkeypatch.setattr(PostViewSet, 'get_object', get_object)
+        assert client.get(f'{EndPoint.POST}/{post.id}/', format='json').data['data']['title'] == 'written meanwhile'
+
+    def test_retrieve_post_cache_evicted_on_user_change(self, client, dummy_posts):
+        user, posts = dummy_posts
+        post = posts.first()
+        _ = client.get(f'{EndPoint.POST}/{post.id}/', format='json')
+        user.first_name = fake.first_name()
+        user.save()
+        response = client.get(f'{EndPoint.POST}/{post.id}/', format='json')
+        assert response.data['data']['user']['first_name'] == user.first_name
+
     def test_post_create(self, auth_client):
         with open(file, 'rb') as image:
             payload = {
@@ -79,6 +230,15 @@ class TestPost:
             response = auth_client.post(f'{EndPoint.POST}/', data=payload, format='multipart')
             assert response.status_code == 201
 
+    def test_post_create_with_duplicate_title(self, auth_client, setup_user_data):
+        user, _ = setup_user_data
+        post = Post.objects.create(user=user, title=fake.name(), description=fake.sentence())
+        with open(file, 'rb') as image:
+            payload = {'title': post.title, 'image': image, 'description': fake.sentence()}
+            response = auth_client.post(f'{EndPoint.POST}/', data=payload, format='multipart')
+        assert response.status_code == 400
+        assert response.data['message'] == 'Post with this title already exist inside your account'
+
     def test_post_create_with_non_authenticated_request(self, client):
         with open(file, 'rb') as image:
             payload = {
@@ -91,6 +251,46 @@ class TestPost:
             print(response.data)
             assert response.status_code == 401
 
+    def test_post_bulk_create(self, auth_client, setup_post_data):
+        post, _ = setup_post_data
+        title = fake.name()
+        payload = [
+            {'title': title, 'description': fake.sentence(), 'publish': True},
+            {'title': title, 'description': fake.sentence()},
+            {'title': post.title, 'description': fake.sentence()},
+            {'title': fake.name()},
+            {'title': fake.name(), 'description': fake.sentence()},
+        ]
+        response = auth_client.post(f'{EndPoint.POST}/bulk/', data=payload, format='json')
+        results = response.data['data']
+        assert response.status_code == 201
+        assert [item['status'] for item in results] == [201, 400, 400, 400, 201]
+        created = Post.objects.get(id=results[0]['id'])
+        assert created.slug == slugify(title) and created.publish is True
+        assert Post.objects.filter(id=results[0]['id'], search_vector__isnull=False).exists()
+
+    def test_post_bulk_create_with_non_list_payload(self, auth_client):
+        response = auth_client.post(f'{EndPoint.POST}/bulk/', data={'title': fake.name()}, format='json')
+        assert response.status_code == 400
+
+    def test_post_export_ndjson(self, auth_client, dummy_posts):
+        user, posts = dummy_posts
+        response = auth_client.get(f'{EndPoint.POST}/export/?user__id={user.id}', format='json')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        assert response['Content-Type'] == 'application/x-ndjson'
+        assert [row['id'] for row in rows] == list(posts.order_by('-created_at').values_list('id', flat=True))
+
+    def test_post_export_csv(self, auth_client, dummy_posts):
+        _ = dummy_posts
+        response = auth_client.get(f'{EndPoint.POST}/export/?export_format=csv&publish=0', format='json')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        assert rows == [['id', 'user_id', 'title', 'slug', 'description', 'image', 'publish', 'comment_count',
+                         'created_at', 'updated_at']]
+
+    def test_post_export_with_invalid_format(self, auth_client):
+        response = auth_client.get(f'{EndPoint.POST}/export/?export_format=xml', format='json')
+        assert response.status_code == 400
+
     def test_post_update(self, auth_client):
         with open(file, 'rb') as image:
             payload = {
@@ -187,3 +387,721 @@ class TestPostComment:
         }
         response = auth_client.post(f'{EndPoint.COMMENT}/', data, 'json')
         assert response.status_code == 201
+
+    def test_comment_thread(self, client, setup_post_data):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        root = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        reply = Comment.objects.create(parent_comment=root, user=user, body=fake.sentence())
+        for _ in range(3):
+            _ = Comment.objects.create(parent_comment=reply, user=user, body=fake.sentence())
+        response = client.get(f'{EndPoint.COMMENT}/thread/?post__id={post.id}', format='json')
+        results = response.data['data']['results']
+        assert response.status_code == 200
+        assert len(results) == 1 and results[0]['reply_count'] == 1
+        assert results[0]['replies'][0]['reply_count'] == 3
+        assert len(results[0]['replies'][0]['replies']) == 3
+
+    def test_comment_thread_subtree_with_depth(self, client, setup_post_data):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        parent = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        chain = [parent]
+        for _ in range(4):
+            chain.append(Comment.objects.create(parent_comment=chain[-1], user=user, body=fake.sentence()))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f'{EndPoint.COMMENT}/thread/?comment_id={chain[1].id}&depth=1', format='json')
+        results = response.data['data']['results']
+        assert [results[0]['id']] == [chain[1].id]
+        assert [node['id'] for node in results[0]['replies']] == [chain[2].id]
+        assert results[0]['replies'][0]['replies'] == []
+        assert len(queries.captured_queries) == 1
+        response = client.get(f'{EndPoint.COMMENT}/thread/?comment_id=0', format='json')
+        assert response.status_code == 400 and response.data['message'] == 'No Comment matches the given query.'
+
+    def test_reply_depth_is_capped_to_the_path_length(self, auth_client, setup_post_data):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        parent = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        _ = Comment.objects.filter(id=parent.id).update(depth=Comment.MAX_DEPTH)
+        response = auth_client.post(f'{EndPoint.COMMENT}/', {'parent_comment_id': parent.id, 'body': 'deep'}, 'json')
+        assert response.status_code == 400 and 'levels deep' in str(response.data['errors'])
+        parent.refresh_from_db()
+        with pytest.raises(ValidationError):
+            _ = Comment.objects.create(parent_comment=parent, user=user, body='deep')
+        assert not Comment.objects.filter(body='deep').exists()
+        assert len(Comment.build_path(10 ** Comment.PATH_STEP_LENGTH - 1) * (Comment.MAX_DEPTH + 1)) <= \
+            Comment._meta.get_field('path').max_length
+
+
+    @pytest.mark.parametrize('size', [2, 8])
+    def test_delete_comment_recounts_once(self, auth_client, setup_post_data, size):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        root = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        chain = [Comment.objects.create(parent_comment=root, user=user, body=fake.sentence())]
+        for _ in range(size):
+            chain.append(Comment.objects.create(parent_comment=chain[-1], user=user, body=fake.sentence()))
+            _ = Comment.objects.create(parent_comment=chain[-1], user=user, body=fake.sentence())
+        with CaptureQueriesContext(connection) as queries:
+            response = auth_client.delete(f'{EndPoint.COMMENT}/{chain[1].id}/', format='json')
+        assert response.status_code == 204
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        assert len(updates) == 2, updates
+        post.refresh_from_db()
+        assert post.comment_count == Comment.objects.filter(post=post).count() == 2
+        assert Comment.objects.get(id=chain[0].id).reply_count == 0
+        assert Comment.objects.get(id=root.id).reply_count == 1
+
+    def test_update_comment_cannot_move_it(self, auth_client, setup_post_data):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        other_post = Post.objects.create(user=user, title=fake.sentence(), description=fake.sentence())
+        comment = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        reply = Comment.objects.create(parent_comment=comment, user=user, body=fake.sentence())
+        other = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        for instance, payload in [(comment, {'post_id': other_post.id}), (reply, {'parent_comment_id': other.id}),
+                                  (reply, {'post_id': other_post.id, 'parent_comment_id': comment.id})]:
+            response = auth_client.put(f'{EndPoint.COMMENT}/{instance.id}/', {**payload, 'body': 'moved'}, 'json')
+            assert response.status_code == 400
+        assert not Comment.objects.filter(body='moved').exists()
+        response = auth_client.put(f'{EndPoint.COMMENT}/{reply.id}/', {'parent_comment_id': comment.id,
+                                                                      'body': 'edited'}, 'json')
+        assert response.status_code == 200
+        reply.refresh_from_db()
+        assert (reply.body, reply.post_id, reply.parent_comment_id) == ('edited', post.id, comment.id)
+        assert reply.path == Comment.build_path(reply.id, comment.path)
+
+    def test_update_comment_keeps_comment_counts(self, auth_client, setup_post_data):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        other_post = Post.objects.create(user=user, title=fake.sentence(), description=fake.sentence())
+        self.prepare_dummy_comment_data(no_of_data=2, user=user, post=post)
+        comment = Comment.objects.filter(post=post).first()
+        _ = auth_client.put(f'{EndPoint.COMMENT}/{comment.id}/', {'post_id': other_post.id, 'body': 'moved'}, 'json')
+        for instance in (post, other_post):
+            response = auth_client.get(f'{EndPoint.POST}/{instance.id}/', format='json')
+            assert response.data['data']['comment_count'] == Comment.objects.filter(post=instance).count()
+
+    def test_delete_comment_without_path_keeps_the_rest_of_the_post(self, auth_client, setup_post_data):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        comment = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        _ = Comment.objects.create(parent_comment=comment, user=user, body=fake.sentence())
+        other = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        # written before paths were maintained
+        Comment.objects.update(path='', depth=0)
+        response = auth_client.delete(f'{EndPoint.COMMENT}/{comment.id}/', format='json')
+        assert response.status_code == 204
+        assert list(Comment.objects.filter(post=post).values_list('id', flat=True)) == [other.id]
+        post.refresh_from_db()
+        assert post.comment_count == 1
+
+    def test_delete_post_skips_its_comment_counters(self, auth_client, setup_post_data):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        self.prepare_dummy_comment_data(no_of_data=5, user=user, post=post)
+        _ = Comment.objects.create(parent_comment=Comment.objects.first(), user=user, body=fake.sentence())
+        with CaptureQueriesContext(connection) as queries:
+            response = auth_client.delete(f'{EndPoint.POST}/{post.id}/', format='json')
+        assert response.status_code == 204 and not Comment.objects.exists()
+        # the post is gone, its recount matches no row and the deleted parents are not recounted at all
+        assert len([query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]) == 1
+
+
+@pytest.mark.django_db
+def test_write_pins_user_to_primary(auth_client, setup_post_data, setup_user_data):
+    post, _ = setup_post_data
+    user, _ = setup_user_data
+    response = auth_client.post(f'{EndPoint.COMMENT}/', {'post_id': post.id, 'body': fake.sentence()}, 'json')
+    assert response.status_code == 201
+    assert user_is_pinned(user.id)
+
+
+@pytest.mark.skipif('replica' not in settings.DATABASES, reason='DB_REPLICA_NAME is not configured')
+@pytest.mark.django_db(databases=['default', 'replica'])
+def test_reads_your_writes_while_others_read_the_replica(auth_client, setup_post_data):
+    """The replica connection runs outside the test transaction, so it lags behind every write of the test"""
+    post, _ = setup_post_data
+    response = auth_client.post(f'{EndPoint.COMMENT}/', {'post_id': post.id, 'body': fake.sentence()}, 'json')
+    assert response.status_code == 201
+    response = auth_client.get(f'{EndPoint.COMMENT}/?post__id={post.id}', format='json')
+    assert len(response.data['data']['results']) == 1
+    response = APIClient().get(f'{EndPoint.COMMENT}/?post__id={post.id}', format='json')
+    assert response.data['data']['results'] == []
+
+
+@pytest.mark.django_db
+def test_shared_cache_fills_read_the_primary(client, setup_post_data, reads):
+    """A cache filled from a lagging replica would serve every reader the stale rows for its whole timeout"""
+    post, _ = setup_post_data
+    for url in [f'{EndPoint.POST}/', f'{EndPoint.POST}/{post.id}/']:
+        reads.clear()
+        assert client.get(url, format='json').status_code == 200
+        assert reads and all(reads), url
+    reads.clear()
+    assert client.get(f'{EndPoint.COMMENT}/?post__id={post.id}', format='json').status_code == 200
+    assert reads and not any(reads)
+
+
+def wait_for_samples(count, timeout=5) -> int:
+    """Samples are written by the buffer's flushing thread, waits until `count` of them are in silk's tables"""
+    deadline = time.monotonic() + timeout
+    while SilkRequest.objects.count() < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return SilkRequest.objects.count()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestSampledProfiling:
+    @pytest.fixture(autouse=True)
+    def sample_buffer(self, settings, monkeypatch):
+        settings.PROFILING_ENABLED = True
+        settings.PROFILING_FLUSH_SIZE = 2
+        monkeypatch.setattr(profiling, '_buffer', None)
+        yield
+        if profiling._buffer is not None:
+            profiling._buffer.stop(timeout=5)
+
+    def test_profiling_is_off_by_default(self, client, dummy_posts, settings):
+        settings.PROFILING_ENABLED = False
+        settings.PROFILING_DEFAULT_SAMPLE_RATE = 1.0
+        _ = client.get(f'{EndPoint.POST}/', format='json')
+        assert profiling._buffer is None and not SilkRequest.objects.exists()
+
+    def test_samples_are_buffered_and_flushed_in_batches(self, client, dummy_posts, settings):
+        settings.PROFILING_SAMPLE_RATES = {'post-api-list': 1.0}
+        _ = client.get(f'{EndPoint.COMMENT}/', format='json')
+        _ = client.get(f'{EndPoint.POST}/', format='json')
+        assert not SilkRequest.objects.exists() and len(profiling.get_sample_buffer().samples) == 1
+        _ = client.get(f'{EndPoint.POST}/?page=2', format='json')
+        assert wait_for_samples(2) == 2
+        requests = SilkRequest.objects.select_related('response').all()
+        assert [request.path for request in requests] == ['/api/v1/post/'] * 2
+        assert all(request.response.status_code == 200 and request.num_sql_queries > 0 for request in requests)
+        assert all('cumulative' in request.pyprofile for request in requests)
+
+    def test_samples_are_flushed_off_the_request_thread(self, client, dummy_posts, settings, monkeypatch):
+        settings.PROFILING_SAMPLE_RATES = {'post-api-list': 1.0}
+        settings.PROFILING_FLUSH_SIZE = 1
+        writers = []
+        write_samples = profiling.write_samples
+        monkeypatch.setattr(profiling, 'write_samples',
+                            lambda samples: writers.append(threading.current_thread()) or write_samples(samples))
+        _ = client.get(f'{EndPoint.POST}/', format='json')
+        assert wait_for_samples(1) == 1
+        assert writers == [profiling.get_sample_buffer().thread] and writers[0] is not threading.current_thread()
+
+    def test_samples_are_flushed_on_the_interval_without_new_requests(self, client, dummy_posts, settings):
+        settings.PROFILING_SAMPLE_RATES = {'post-api-list': 1.0}
+        settings.PROFILING_FLUSH_INTERVAL = 0.1
+        _ = client.get(f'{EndPoint.POST}/', format='json')
+        assert wait_for_samples(1) == 1
+
+    def test_header_triggers_a_profile(self, client, settings):
+        settings.PROFILING_HEADER_TOKEN = 'profile-me'
+        settings.PROFILING_FLUSH_SIZE = 1
+        _ = client.get(f'{EndPoint.POST}/', format='json', HTTP_X_PROFILE='wrong')
+        assert not SilkRequest.objects.exists()
+        _ = client.get(f'{EndPoint.POST}/', format='json', HTTP_X_PROFILE='profile-me')
+        assert wait_for_samples(1) == 1
+
+
+@pytest.mark.django_db
+class TestMetrics:
+    @staticmethod
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def get_list_post_samples(self):
+        return [
+            self.sample('http_request_duration_seconds_count', view='PostViewSet', action='list', method='GET'),
+            self.sample('cache_requests_total', prefix='post', result='hit'),
+            self.sample('cache_requests_total', prefix='post', result='miss'),
+            self.sample('serializer_duration_seconds_count', serializer='PostValuesSerializer'),
+            self.sample('db_queries_per_request_count', view='PostViewSet', action='list'),
+        ]
+
+    def test_list_post_is_measured(self, client, dummy_posts):
+        before = self.get_list_post_samples()
+        for _ in range(2):
+            _ = client.get(f'{EndPoint.POST}/', format='json')
+        after = self.get_list_post_samples()
+        assert [current - previous for current, previous in zip(after, before)] == [2, 1, 1, 1, 2]
+
+    def test_metrics_endpoint(self, client, dummy_posts):
+        _ = client.get(f'{EndPoint.POST}/', format='json')
+        response = client.get(EndPoint.METRICS)
+        assert response.status_code == 200
+        assert b'http_request_duration_seconds_bucket{action="list"' in response.content
+        assert b'cache_requests_total{prefix="post",result="miss"}' in response.content
+
+    def test_metrics_endpoint_with_token(self, client, settings):
+        settings.METRICS_TOKEN = 'scrape-me'
+        assert client.get(EndPoint.METRICS).status_code == 403
+        assert client.get(EndPoint.METRICS, HTTP_AUTHORIZATION='Bearer scrape-me').status_code == 200
+
+    def test_metrics_endpoint_aggregates_worker_processes(self, client, monkeypatch, tmp_path):
+        # each worker declares the app's metrics and writes its samples to the shared directory
+        worker = (
+            'import sys\n'
+            'from prometheus_client import Counter, Histogram\n'
+            'requests = Counter("http_requests", "", ["view", "action", "method", "status"])\n'
+            'latency = Histogram("http_request_duration_seconds", "", ["view", "action", "method"])\n'
+            'for _ in range(int(sys.argv[1])):\n'
+            '    requests.labels("PostViewSet", "list", "GET", "200").inc()\n'
+            '    latency.labels("PostViewSet", "list", "GET").observe(0.5)\n'
+        )
+        for count in (2, 3):
+            _ = subprocess.run([sys.executable, '-c', worker, str(count)], check=True,
+                               env={**os.environ, MULTIPROCESS_ENV: str(tmp_path)})
+        # one file per metric type and process id
+        assert len({path.stem.rsplit('_', 1)[1] for path in tmp_path.glob('*.db')}) == 2
+        monkeypatch.setenv(MULTIPROCESS_ENV, str(tmp_path))
+        response = client.get(EndPoint.METRICS)
+        assert response.status_code == 200
+        content = response.content.decode()
+        assert 'http_requests_total{action="list",method="GET",status="200",view="PostViewSet"} 5.0' in content
+        assert 'http_request_duration_seconds_count{action="list",method="GET",view="PostViewSet"} 5.0' in content
+        assert 'http_request_duration_seconds_sum{action="list",method="GET",view="PostViewSet"} 2.5' in content
+
+
+@pytest.mark.django_db
+class TestQueryBudgets:
+    """Each action runs against large_dataset, so a query issued per row exceeds the declared budget"""
+
+    @pytest.mark.parametrize('query', ['?limit=50', '?cursor=&limit=50', '?q=dataset&limit=50', '?publish=1&limit=50',
+                                       '?user__id={user_id}&limit=50', '?search={title}&limit=50',
+                                       '?ordering=title&limit=50'])
+    def test_list_post(self, client, large_dataset, query_budget, query):
+        owner, posts = large_dataset
+        query = query.format(user_id=owner.id, title=posts[0].title.split()[0])
+        with query_budget(PostViewSet, 'list'):
+            response = client.get(f'{EndPoint.POST}/{query}', format='json')
+        assert response.status_code == 200 and response.data['data']['results']
+
+    def test_retrieve_post(self, client, large_dataset, query_budget):
+        _, posts = large_dataset
+        with query_budget(PostViewSet, 'retrieve'):
+            response = client.get(f'{EndPoint.POST}/{posts[0].id}/', format='json')
+        assert response.status_code == 200
+
+    def test_export_post(self, auth_client, large_dataset, query_budget):
+        with query_budget(PostViewSet, 'export'):
+            response = auth_client.get(f'{EndPoint.POST}/export/', format='json')
+            rows = b''.join(response.streaming_content).splitlines()
+        assert len(rows) == Post.objects.count()
+
+    def test_create_post(self, auth_client, large_dataset, query_budget):
+        with open(file, 'rb') as image, query_budget(PostViewSet, 'create'):
+            payload = {'title': fake.sentence(), 'image': image, 'description': fake.sentence()}
+            response = auth_client.post(f'{EndPoint.POST}/', data=payload, format='multipart')
+        assert response.status_code == 201
+
+    def test_bulk_create_post(self, auth_client, large_dataset, query_budget):
+        payload = [{'title': f'{fake.sentence()} {index}', 'description': fake.sentence()} for index in range(50)]
+        with query_budget(PostViewSet, 'bulk_create'):
+            response = auth_client.post(f'{EndPoint.POST}/bulk/', data=payload, format='json')
+        assert response.status_code == 201
+
+    def test_update_post(self, auth_client, large_dataset, query_budget):
+        _, posts = large_dataset
+        with query_budget(PostViewSet, 'update'):
+            response = auth_client.put(f'{EndPoint.POST}/{posts[0].id}/', format='json',
+                                       data={'title': fake.sentence(), 'description': fake.sentence()})
+        assert response.status_code == 200
+
+    def test_delete_post(self, auth_client, large_dataset, query_budget):
+        _, posts = large_dataset
+        assert posts[0].comments.count() == 28
+        with query_budget(PostViewSet, 'destroy'):
+            response = auth_client.delete(f'{EndPoint.POST}/{posts[0].id}/', format='json')
+        assert response.status_code == 204 and not Comment.objects.filter(post_id=posts[0].id).exists()
+
+    def test_list_comment(self, client, large_dataset, query_budget):
+        _, posts = large_dataset
+        with query_budget(PostCommentViewSet, 'list'):
+            response = client.get(f'{EndPoint.COMMENT}/?post__id={posts[0].id}', format='json')
+        assert len(response.data['data']['results']) == 28
+
+    def test_comment_thread(self, client, large_dataset, query_budget):
+        _, posts = large_dataset
+        with query_budget(PostCommentViewSet, 'thread'):
+            response = client.get(f'{EndPoint.COMMENT}/thread/?post__id={posts[0].id}', format='json')
+        assert len(response.data['data']['results']) == 4
+
+    def test_comment_subtree(self, client, large_dataset, query_budget):
+        root = Comment.objects.filter(depth=0).order_by('id').first()
+        with query_budget(PostCommentViewSet, 'thread'):
+            response = client.get(f'{EndPoint.COMMENT}/thread/?comment_id={root.id}&depth=1', format='json')
+        results = response.data['data']['results']
+        assert [result['id'] for result in results] == [root.id] and len(results[0]['replies']) == 2
+
+    def test_export_comment(self, auth_client, large_dataset, query_budget):
+        with query_budget(PostCommentViewSet, 'export'):
+            response = auth_client.get(f'{EndPoint.COMMENT}/export/', format='json')
+            rows = b''.join(response.streaming_content).splitlines()
+        assert len(rows) == Comment.objects.count()
+
+    def test_create_comment(self, auth_client, large_dataset, query_budget):
+        comment = Comment.objects.filter(depth=1).first()
+        with query_budget(PostCommentViewSet, 'create'):
+            response = auth_client.post(f'{EndPoint.COMMENT}/', {'parent_comment_id': comment.id,
+                                                                 'body': fake.sentence()}, 'json')
+        assert response.status_code == 201
+
+    def test_update_comment(self, auth_client, large_dataset, query_budget):
+        comment = Comment.objects.filter(user=large_dataset[0]).first()
+        with query_budget(PostCommentViewSet, 'update'):
+            response = auth_client.put(f'{EndPoint.COMMENT}/{comment.id}/', {'post_id': comment.post_id,
+                                                                             'body': fake.sentence()}, 'json')
+        assert response.status_code == 200
+
+    def test_delete_comment(self, auth_client, large_dataset, query_budget):
+        owner, posts = large_dataset
+        root = Comment.objects.create(post=posts[0], user=owner, body=fake.sentence())
+        for _ in range(3):
+            reply = Comment.objects.create(parent_comment=root, user=owner, body=fake.sentence())
+            for _ in range(5):
+                _ = Comment.objects.create(parent_comment=reply, user=owner, body=fake.sentence())
+        with query_budget(PostCommentViewSet, 'destroy'):
+            response = auth_client.delete(f'{EndPoint.COMMENT}/{root.id}/', format='json')
+        assert response.status_code == 204 and not Comment.objects.filter(path__startswith=root.path).exists()
+
+    def test_login(self, client, setup_user_data, query_budget):
+        _, user_info = setup_user_data
+        with query_budget(AuthViewSet, 'login'):
+            response = client.post(EndPoint.LOGIN, {'username': user_info['email'], 'password': user_info['password']},
+                                   'json')
+        assert response.status_code == 200
+
+    def test_register(self, client, dummy_user_data, query_budget):
+        with query_budget(AuthViewSet, 'register'):
+            response = client.post(EndPoint.REGISTER, dummy_user_data, format='json')
+        assert response.status_code == 201
+
+
+@pytest.mark.django_db
+class TestQueryPlans:
+    @pytest.mark.parametrize('query, index', [
+        ('', 'post_created_at_id_idx'),
+        # no composite index leads with user_id alone, the foreign key index serves it
+        ('?user__id={user_id}', 'core_post_user_id_ae5590f8'),
+        ('?publish=1', 'post_publish_created_idx'),
+        ('?user__id={user_id}&publish=1', 'post_user_publish_created_idx'),
+        ('?cursor=', 'post_created_at_id_idx'),
+        ('?q=lorem', 'post_search_vector_idx'),
+    ])
+    def test_list_post_uses_indexes(self, client, plan_dataset, assert_no_seq_scan, query, index):
+        user, _ = plan_dataset
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f'{EndPoint.POST}/{query.format(user_id=user.id)}', format='json')
+        assert response.status_code == 200
+        assert_no_seq_scan(queries.captured_queries, 'core_post', index)
+
+    def test_list_comment_uses_indexes(self, client, plan_dataset, assert_no_seq_scan):
+        post = plan_dataset[1][0]
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f'{EndPoint.COMMENT}/?post__id={post.id}', format='json')
+        assert response.status_code == 200
+        assert_no_seq_scan(queries.captured_queries, 'core_comment', 'comment_post_timestamp_idx')
+
+    @pytest.mark.parametrize('query, indexes', [
+        # a whole thread is read and sorted in full, the planner bounds it with the smaller of the post composites
+        ('post__id={post_id}', [r'comment_post_(path|timestamp)_idx']),
+        ('comment_id={comment_id}&depth=1', ['comment_post_path_idx', 'core_comment_pkey']),
+    ])
+    def test_comment_thread_uses_indexes(self, client, plan_dataset, assert_no_seq_scan, query, indexes):
+        post = plan_dataset[1][0]
+        comment = Comment.objects.create(post=post, user=post.user, body=fake.sentence())
+        _ = Comment.objects.create(parent_comment=comment, user=post.user, body=fake.sentence())
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f'{EndPoint.COMMENT}/thread/?{query.format(post_id=post.id, comment_id=comment.id)}',
+                                  format='json')
+        assert response.status_code == 200
+        assert_no_seq_scan(queries.captured_queries, 'core_comment', *indexes)
+
+    def test_login_by_email_uses_indexes(self, client, setup_user_data, plan_dataset, assert_no_seq_scan):
+        _, user_info = setup_user_data
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(EndPoint.LOGIN, {'username': user_info['email'].upper(),
+                                                    'password': user_info['password']}, 'json')
+        assert response.status_code == 200
+        assert_no_seq_scan(queries.captured_queries, 'core_user', 'user_email_unique')
+
+
+@pytest.mark.django_db(transaction=True)
+class TestAsyncRead:
+    """The async views run their ORM work on pool threads, which only see committed rows"""
+
+    def test_async_list_post_matches_sync(self, client, dummy_posts):
+        user, _ = dummy_posts
+        for query in ['', f'?user__id={user.id}&limit=2', '?cursor=&limit=2']:
+            response = client.get(f'{EndPoint.ASYNC_POST}/{query}')
+            assert response.status_code == 200
+            assert response.json() == client.get(f'{EndPoint.POST}/{query}', format='json').json()
+
+    def test_async_retrieve_post_matches_sync(self, client, dummy_posts):
+        _, posts = dummy_posts
+        post = posts.first()
+        response = client.get(f'{EndPoint.ASYNC_POST}/{post.id}/')
+        assert response.json() == client.get(f'{EndPoint.POST}/{post.id}/', format='json').json()
+        assert client.get(f'{EndPoint.ASYNC_POST}/0/').status_code == 400
+
+    def test_async_list_comment_matches_sync(self, client, setup_post_data):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        TestPostComment.prepare_dummy_comment_data(no_of_data=4, user=user, post=post)
+        response = client.get(f'{EndPoint.ASYNC_COMMENT}/?post__id={post.id}')
+        assert len(response.json()['data']['results']) == 4
+        assert response.json() == client.get(f'{EndPoint.COMMENT}/?post__id={post.id}', format='json').json()
+
+    def test_asgi_chain_runs_the_views_on_the_event_loop(self, asgi_get, async_cache, dummy_posts, monkeypatch):
+        """
+        A sync only middleware makes django adapt the chain under ASGI and drive the async view through
+        async_to_sync from a worker thread. The only hops allowed are django's own MiddlewareMixin hooks,
+        signals and response.close
+        """
+        hops, blocking_calls = [], []
+        sync_to_async_init, async_to_sync_init = sync.SyncToAsync.__init__, sync.AsyncToSync.__init__
+        monkeypatch.setattr(sync.SyncToAsync, '__init__', lambda self, func, *args, **kwargs: (
+            hops.append(func), sync_to_async_init(self, func, *args, **kwargs))[1])
+        monkeypatch.setattr(sync.AsyncToSync, '__init__', lambda self, func, *args, **kwargs: (
+            blocking_calls.append(func), async_to_sync_init(self, func, *args, **kwargs))[1])
+        status, _, _ = asgi_get(urlsplit(EndPoint.ASYNC_POST).path + '/')
+        assert status == 200 and blocking_calls == []
+        assert hops and all(func.__module__.startswith('django.') for func in hops), hops
+        assert all(getattr(func, '__name__', '') != '_get_response' for func in hops)
+
+    def test_asgi_responses_match_sync(self, client, asgi_get, async_cache, dummy_posts, monkeypatch):
+        user, posts = dummy_posts
+        post = posts.first()
+        _ = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        threads = []
+        get_list_data = PostViewSet.get_list_data
+        monkeypatch.setattr(PostViewSet, 'get_list_data', lambda view: (
+            threads.append(threading.current_thread().name), get_list_data(view))[1])
+        for url, query in [(f'{EndPoint.ASYNC_POST}/', f'user__id={user.id}&limit=2'),
+                           (f'{EndPoint.ASYNC_POST}/{post.id}/', ''),
+                           (f'{EndPoint.ASYNC_COMMENT}/', f'post__id={post.id}')]:
+            status, headers, body = asgi_get(urlsplit(url).path, query)
+            assert status == 200 and headers['Content-Type'] == 'application/json'
+            sync_url = url.replace(EndPoint.ASYNC_POST, EndPoint.POST)
+            assert json.loads(body) == client.get(f'{sync_url}?{query}', format='json').json()
+        # the ORM work of the async list ran on the bounded pool, not on the event loop
+        assert threads[0].startswith('async-blocking')
+
+    @pytest.mark.parametrize('url, model', [(EndPoint.POST, Post), (EndPoint.COMMENT, Comment)])
+    def test_asgi_streams_exports(self, auth_client, asgi_get, setup_post_data, url, model):
+        post, _ = setup_post_data
+        TestPostComment.prepare_dummy_comment_data(no_of_data=3, user=post.user, post=post)
+        headers = [('authorization', auth_client._credentials['HTTP_AUTHORIZATION'])]
+        for export_format in ('ndjson', 'csv'):
+            status, _, body = asgi_get(urlsplit(url).path + '/export/', f'export_format={export_format}',
+                                                 headers)
+            assert status == 200, body
+            response = auth_client.get(f'{url}/export/?export_format={export_format}')
+            assert body == b''.join(response.streaming_content)
+        assert len(body.splitlines()) == model.objects.count() + 1
+
+    def test_async_reads_honor_the_read_your_writes_pin(self, auth_client, async_cache, setup_post_data, reads):
+        post, _ = setup_post_data
+        assert APIClient().get(f'{EndPoint.ASYNC_COMMENT}/?post__id={post.id}').status_code == 200
+        assert reads and not any(reads)
+        response = auth_client.post(f'{EndPoint.COMMENT}/', {'post_id': post.id, 'body': fake.sentence()}, 'json')
+        assert response.status_code == 201
+        for url in [f'{EndPoint.ASYNC_POST}/', f'{EndPoint.ASYNC_POST}/{post.id}/',
+                    f'{EndPoint.ASYNC_COMMENT}/?post__id={post.id}']:
+            reads.clear()
+            assert auth_client.get(url).status_code == 200
+            assert reads and all(reads), url
+        reads.clear()
+        assert APIClient().get(f'{EndPoint.ASYNC_COMMENT}/?post__id={post.id}').status_code == 200
+        assert reads and not any(reads)
+
+    def test_async_cache_fills_read_the_primary(self, client, async_cache, setup_post_data, reads):
+        post, _ = setup_post_data
+        for url in [f'{EndPoint.ASYNC_POST}/', f'{EndPoint.ASYNC_POST}/{post.id}/']:
+            reads.clear()
+            assert client.get(url).status_code == 200
+            assert reads and all(reads), url
+
+    def test_async_endpoints_are_read_only(self, client):
+        assert client.post(f'{EndPoint.ASYNC_POST}/', {}, format='json').status_code == 405
+
+
+@pytest.mark.django_db
+class TestCompression:
+    """Cached pages are stored compressed per negotiated coding, a hit is served without encoding again"""
+
+    @pytest.mark.parametrize('accept_encoding, content_encoding, decompress', [
+        ('gzip, deflate, br', 'br', brotli.decompress),
+        ('gzip, br;q=0', 'gzip', gzip.decompress),
+    ])
+    def test_list_post_is_compressed_once(self, client, dummy_posts, monkeypatch, accept_encoding,
+                                          content_encoding, decompress):
+        expected = client.get(f'{EndPoint.POST}/', format='json').json()
+        response = client.get(f'{EndPoint.POST}/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        assert response['Content-Encoding'] == content_encoding and 'Accept-Encoding' in response['Vary']
+        assert json.loads(decompress(response.content)) == expected
+        monkeypatch.setattr(compression, 'compress', lambda *args: pytest.fail('cache hit encoded again'))
+        cached = client.get(f'{EndPoint.POST}/', HTTP_ACCEPT_ENCODING=f' {accept_encoding} ')
+        assert cached['Content-Encoding'] == content_encoding and cached.content == response.content
+
+    def test_list_post_without_accept_encoding(self, client, dummy_posts):
+        for accept_encoding in ['', 'identity', 'gzip;q=0, br;q=0']:
+            response = client.get(f'{EndPoint.POST}/', HTTP_ACCEPT_ENCODING=accept_encoding)
+            assert not response.has_header('Content-Encoding') and response.json()['data']['results']
+
+    @pytest.mark.django_db(transaction=True)
+    def test_async_list_post_is_compressed_once(self, client, dummy_posts, monkeypatch):
+        store = {}
+
+        async def cache_get(key):
+            return store.get(key)
+
+        async def cache_set(key, value, timeout):
+            store[key] = value
+
+        monkeypatch.setattr('core.async_views.async_cache_get', cache_get)
+        monkeypatch.setattr('core.async_views.async_cache_set', cache_set)
+        expected = client.get(f'{EndPoint.ASYNC_POST}/').json()
+        response = client.get(f'{EndPoint.ASYNC_POST}/', HTTP_ACCEPT_ENCODING='gzip')
+        assert response['Content-Encoding'] == 'gzip' and json.loads(gzip.decompress(response.content)) == expected
+        monkeypatch.setattr(compression, 'compress', lambda *args: pytest.fail('cache hit encoded again'))
+        cached = client.get(f'{EndPoint.ASYNC_POST}/', HTTP_ACCEPT_ENCODING='gzip')
+        assert cached['Content-Encoding'] == 'gzip' and cached.content == response.content
+
+
+@pytest.mark.django_db
+class TestConditionalGet:
+    """ETags come from cached versions, a matching If-None-Match costs a cache read and no SQL"""
+
+    @staticmethod
+    def get_etag(client, url):
+        response = client.get(url, format='json')
+        assert response.status_code == 200 and response['ETag'].startswith('W/"')
+        return response['ETag']
+
+    def test_list_post_not_modified(self, client, dummy_posts, django_assert_num_queries):
+        etag = self.get_etag(client, f'{EndPoint.POST}/')
+        with django_assert_num_queries(0):
+            response = client.get(f'{EndPoint.POST}/', format='json', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304 and response['ETag'] == etag and not response.content
+        assert self.get_etag(client, f'{EndPoint.POST}/?page=2') != etag
+        # the newest post is on the first page
+        post = Post.objects.order_by('-created_at', '-id').first()
+        post.title = fake.sentence()
+        post.save()
+        response = client.get(f'{EndPoint.POST}/', format='json', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200 and response['ETag'] != etag
+        with django_assert_num_queries(0):
+            response = client.get(f'{EndPoint.POST}/', format='json', HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 304
+
+    def test_list_post_etag_follows_the_cached_page(self, client, dummy_posts):
+        """A comment leaves the cached list in place, clients holding its ETag keep getting 304s until it expires"""
+        user, _ = dummy_posts
+        post = Post.objects.order_by('-created_at', '-id').first()
+        etag = self.get_etag(client, f'{EndPoint.POST}/')
+        _ = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        response = client.get(f'{EndPoint.POST}/', format='json', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304 and response['ETag'] == etag
+        # once the page has expired the rebuilt body comes with a new ETag
+        cache.clear()
+        response = client.get(f'{EndPoint.POST}/', format='json', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200 and response['ETag'] != etag
+        counts = {item['id']: item['comment_count'] for item in response.data['data']['results']}
+        assert counts[post.id] == 1
+
+    def test_retrieve_post_not_modified(self, client, dummy_posts, django_assert_num_queries):
+        user, posts = dummy_posts
+        post = posts.first()
+        url = f'{EndPoint.POST}/{post.id}/'
+        etag = self.get_etag(client, url)
+        with django_assert_num_queries(0):
+            assert client.get(url, format='json', HTTP_IF_NONE_MATCH=etag).status_code == 304
+        _ = Comment.objects.create(post=post, user=user, body=fake.sentence())
+        response = client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200 and response.data['data']['comment_count'] == 1
+        assert response['ETag'] != etag
+        assert client.get(f'{EndPoint.POST}/0/', format='json').has_header('ETag') is False
+
+    def test_list_comment_not_modified(self, auth_client, setup_post_data, django_assert_num_queries):
+        post, user_info = setup_post_data
+        user = User.objects.get(email=user_info.get('email'))
+        TestPostComment.prepare_dummy_comment_data(no_of_data=2, user=user, post=post)
+        url = f'{EndPoint.COMMENT}/?post__id={post.id}'
+        etag = self.get_etag(auth_client, url)
+        with django_assert_num_queries(0):
+            assert auth_client.get(url, format='json', HTTP_IF_NONE_MATCH=etag).status_code == 304
+        comment = Comment.objects.filter(post=post).first()
+        response = auth_client.put(f'{EndPoint.COMMENT}/{comment.id}/', data={'post_id': post.id, 'body': 'edited'},
+                                   format='json')
+        assert response.status_code == 200
+        response = auth_client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200 and 'edited' in [item['body'] for item in response.data['data']['results']]
+        updated_etag = response['ETag']
+        TestPostComment.prepare_dummy_comment_data(no_of_data=1, user=user, post=post)
+        assert self.get_etag(auth_client, url) not in (etag, updated_etag)
+        assert auth_client.get(f'{EndPoint.COMMENT}/', format='json').has_header('ETag') is False
+
+
+@pytest.mark.django_db
+class TestPageCacheStampede:
+    """A page is rebuilt by one request at a time, the others are served the previous page"""
+
+    @staticmethod
+    def count_rebuilds(monkeypatch, delay=0.0):
+        calls = []
+        get_list_data = PostViewSet.get_list_data
+
+        def counting_get_list_data(view):
+            calls.append(1)
+            time.sleep(delay)
+            return get_list_data(view)
+
+        monkeypatch.setattr(PostViewSet, 'get_list_data', counting_get_list_data)
+        return calls
+
+    def test_stale_page_is_served_while_rebuilding(self, client, dummy_posts, django_assert_num_queries):
+        user, _ = dummy_posts
+        response = client.get(f'{EndPoint.POST}/', format='json')
+        total = response.data['data']['total']
+        _ = Post.objects.create(user=user, title=fake.sentence(), description=fake.sentence(), publish=True)
+        lock_key = get_page_lock_key('post', response.wsgi_request.build_absolute_uri())
+        assert cache.add(lock_key, 'another request', timeout=10)
+        with django_assert_num_queries(0):
+            stale = client.get(f'{EndPoint.POST}/', format='json')
+        assert stale.data['data']['total'] == total
+        cache.delete(lock_key)
+        assert client.get(f'{EndPoint.POST}/', format='json').data['data']['total'] == total + 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_concurrent_misses_rebuild_once(self, dummy_posts, monkeypatch):
+        calls = self.count_rebuilds(monkeypatch, delay=0.3)
+        responses, barrier = [], threading.Barrier(6)
+
+        def fetch():
+            try:
+                barrier.wait()
+                responses.append(APIClient().get(f'{EndPoint.POST}/', format='json'))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=fetch) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert [response.status_code for response in responses] == [200] * 6
+        assert len({response.content for response in responses}) == 1
+
+    @pytest.mark.parametrize('beta, rebuilds', [(0, 1), (1e12, 3)])
+    def test_early_refresh(self, client, dummy_posts, monkeypatch, settings, beta, rebuilds):
+        settings.PAGE_CACHE_EARLY_REFRESH_BETA = beta
+        calls = self.count_rebuilds(monkeypatch)
+        for _ in range(3):
+            assert client.get(f'{EndPoint.POST}/', format='json').status_code == 200
+        assert len(calls) == rebuilds